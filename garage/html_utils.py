@@ -14,43 +14,77 @@ from __future__ import (absolute_import, unicode_literals)
 
 import six
 import re
+import copy
+import threading
+import uuid
 from htmlentitydefs import codepoint2name, name2codepoint
-from markdown import markdown
-from textile import textile
+from six.moves.html_parser import HTMLParser
+try:
+    from six.moves.html_parser import HTMLParseError
+except ImportError:
+    # removed in Python 3.5 (HTMLParser no longer raises errors)
+    class HTMLParseError(Exception):
+        pass
+
+from garage.utils import LRUCache
 
 
 # functions to escape html special characters
 
+HTML_CHARS = {
+    "&": "&amp;",
+    '"': "&quot;",
+    "'": "&apos;",
+    ">": "&gt;",
+    "<": "&lt;",
+}
+HTML_ESCAPE_TABLE = dict((ord(c), e) for c, e in HTML_CHARS.items())
+HtmlCharsRegexp = re.compile(r'[&"\'<>]')
+
 def html_escape(text):
     """
     Escape reserved html characters within text.
+    * text without reserved characters is returned unchanged.
     """
-    htmlchars = {
-        "&": "&amp;",
-        '"': "&quot;",
-        "'": "&apos;",
-        ">": "&gt;",
-        "<": "&lt;",
-    }
-    if isinstance(text, six.text_type):
-        text = ''.join([htmlchars.get(c, c) for c in text])
+    if isinstance(text, six.text_type) and HtmlCharsRegexp.search(text):
+        text = text.translate(HTML_ESCAPE_TABLE)
     return text
 
 
+class EntityMap(dict):
+    """
+    Translate table (for ``unicode.translate``) to convert non-ascii
+    characters to html entities.
+    * entities are looked up the first time a character is
+      encountered and cached.
+    """
+
+    def __init__(self):
+        super(EntityMap, self).__init__(
+            (n, six.unichr(n)) for n in range(128))
+
+    def __missing__(self, codepoint):
+        try:
+            entity = '&%s;' % codepoint2name[codepoint]
+        except KeyError:
+            entity = '&#%s;' % codepoint
+        self[codepoint] = entity
+        return entity
+
+HTML_ENTITIES_MAP = EntityMap()
+
 def html_entities(u):
     """
     Convert non-ascii characters to old-school html entities.
+    * ascii text is returned unchanged.
     """
-    result = []
-    for c in u:
-        if ord(c) < 128:
-            result.append(c)
-        else:
-            try:
-                result.append('&%s;' % codepoint2name[ord(c)])
-            except KeyError:
-                result.append("&#%s;" % ord(c))
-    return ''.join(result)
+    if not isinstance(u, six.text_type):
+        return ''.join([HTML_ENTITIES_MAP[ord(c)] for c in u])
+    try:
+        u.encode('ascii')
+    except UnicodeEncodeError:
+        return u.translate(HTML_ENTITIES_MAP)
+    return u
 
 
 def escape(txt):
@@ -63,35 +97,76 @@ def escape(txt):
     return html_escape(html_entities(txt))
 
 
+class EntityRefMap(dict):
+    """
+    Map of entity and character references to characters.
+    * named entities (e.g. '&amp;') are precomputed.
+    * numeric character references (e.g. '&#233;') are decoded the
+      first time they are looked up and cached; the cache is reset
+      to the named entities when it exceeds maxsize entries.
+    * unknown or invalid references map to themselves.
+    * named entities are looked up in ``named`` first when missing,
+      so lookups from other threads while the cache is being reset
+      still decode them.
+    """
+
+    def __init__(self, maxsize=None):
+        super(EntityRefMap, self).__init__(
+            ('&%s;' % name, six.unichr(codepoint))
+            for name, codepoint in name2codepoint.items())
+        self.named = dict(self)
+        self.maxsize = len(self.named) + (maxsize or CHARREF_CACHE_SIZE)
+
+    def __missing__(self, text):
+        try:
+            return self.named[text]
+        except KeyError:
+            pass
+        c = text
+        if text[:2] == "&#":
+            try:
+                if text[:3] == "&#x":
+                    c = six.unichr(int(text[3:-1], 16))
+                else:
+                    c = six.unichr(int(text[2:-1]))
+            except (ValueError, OverflowError):
+                pass
+        if len(self) >= self.maxsize:
+            self.clear()
+            self.update(self.named)
+        self[text] = c
+        return c
+
+
+# number of numeric character references to cache
+CHARREF_CACHE_SIZE = 1000
+
+ENTITY_REFS = EntityRefMap()
+EntityRegexp = re.compile(r'&#?\w+;')
+
+def unescape_entity(m):
+    """
+    Return character for entity or character reference match object.
+    """
+    return ENTITY_REFS[m.group()]
+
+
 def unescape(text):
     """
     Removes HTML or XML character references and entities from a text string.
     * Note: does not strip html tags (use `strip_tags` instead for that).
+    * text without '&' is returned unchanged.
 
     :Info: http://effbot.org/zone/re-sub.htm#unescape-html
 
     :param text: The HTML (or XML) source text.
     :return: The plain text, as a Unicode string, if necessary.
     """
-    def fixup(m):
-        text = m.group(0)
-        if text[:2] == "&#":
-            # character reference
-            try:
-                if text[:3] == "&#x":
-                    return unichr(int(text[3:-1], 16))
-                else:
-                    return unichr(int(text[2:-1]))
-            except ValueError:
-                pass
-        else:
-            # named entity
-            try:
-                text = unichr(name2codepoint[text[1:-1]])
-            except KeyError:
-                pass
-        return text # leave as is
-    return re.sub("&#?\w+;", fixup, text)
+    # native string literal, so byte strings are not decoded on
+    # Python 2
+    if str('&') not in text:
+        return text
+    return EntityRegexp.sub(unescape_entity, text)
 
 
 def strip_tags(html_txt):
@@ -141,23 +216,277 @@ CONVERSION_METHODS = (
     (VISUAL_EDITOR, 'visual')
 )
 
-def txt2html(txt, method):
+# text-to-html converters
+# * converter engines are expensive to set up, so one engine per
+#   conversion method is created for each thread and reused (the
+#   engine is reset before each conversion).
+# * CONVERTERS maps conversion methods to factory functions that
+#   return a converter (a callable that takes text and returns html).
+
+def markdown_converter():
+    """
+    Return converter using a reusable ``markdown.Markdown`` engine.
+    """
+    from markdown import Markdown
+    engine = Markdown()
+
+    def convert(txt):
+        engine.reset()
+        return engine.convert(txt)
+    return convert
+
+
+def textile_converter():
+    """
+    Return converter using a reusable ``textile.Textile`` engine.
+    * the engine's attributes are restored to their state right after
+      construction before each conversion (containers are copied), so
+      no per-document state (footnotes, notes, link references, etc.)
+      is carried over to the next document.
+    """
+    from textile import Textile
+    engine = Textile()
+    parse = getattr(engine, 'parse', None) or engine.textile
+    initial_state = dict(engine.__dict__)
+
+    def convert(txt):
+        engine.__dict__.clear()
+        for name, value in initial_state.items():
+            if isinstance(value, (dict, list, set)):
+                value = copy.copy(value)
+            engine.__dict__[name] = value
+        if hasattr(engine, 'linkPrefix'):
+            # footnote/link ids must be unique for each document
+            engine.linkPrefix = '%s-' % uuid.uuid4().hex
+        return parse(txt)
+    return convert
+
+
+CONVERTERS = {
+    MARKDOWN_CONVERSION: markdown_converter,
+    TEXTILE_CONVERSION: textile_converter,
+    SIMPLE_CONVERSION: markdown_converter,
+}
+
+# converters created for the current thread (keyed by method)
+# * each thread discards its converters when the registry generation
+#   changes (i.e. after ``register_converter`` is called).
+_converters = threading.local()
+_converters_generation = 0
+
+def register_converter(method, factory):
+    """
+    Register converter factory for conversion method.
+    * factory is called (once per thread) to create a converter.
+
+    :param method: conversion method (e.g. MARKDOWN_CONVERSION)
+    :param factory: function that returns a converter
+    """
+    global _converters_generation
+    CONVERTERS[method] = factory
+    _converters_generation += 1
+
+
+def get_converter(method):
+    """
+    Return converter for conversion method for the current thread.
+
+    :param method: conversion method (e.g. MARKDOWN_CONVERSION)
+    :returns: converter (callable) or None if method does not convert
+    """
+    if getattr(_converters, 'generation', None) != _converters_generation:
+        _converters.generation = _converters_generation
+        _converters.engines = {}
+    converters = _converters.engines
+    try:
+        return converters[method]
+    except KeyError:
+        factory = CONVERTERS.get(method)
+        converter = factory() if factory is not None else None
+        converters[method] = converter
+        return converter
+
+
+# render cache
+# * rendered html is cached using a hash of the text and conversion
+#   method as key.
+# * set HTML_RENDER_CACHE in settings to enable caching for all
+#   conversions: 'local' (in-process LRU cache), 'django' (Django's
+#   default cache backend) or any object with ``get`` and ``set``
+#   methods.
+
+HTML_RENDER_CACHE_SIZE = 1000
+HTML_RENDER_CACHE_PREFIX = 'garage.html_utils.txt2html:'
+
+_local_render_cache = []
+
+def get_render_cache(cache=None):
+    """
+    Return cache object to store rendered html.
+
+    :param cache: 'local', 'django', a cache object or None to use
+           HTML_RENDER_CACHE from settings
+    :returns: cache object or None if caching is disabled
+    """
+    if cache is None:
+        from garage import get_setting
+        cache = get_setting('HTML_RENDER_CACHE')
+    if cache is None or cache is False:
+        return None
+    if cache == 'local':
+        if not _local_render_cache:
+            _local_render_cache.append(LRUCache(HTML_RENDER_CACHE_SIZE))
+        cache = _local_render_cache[0]
+    elif cache == 'django':
+        from django.core.cache import cache
+    return cache
+
+
+def get_content_hash(txt, method):
+    """
+    Return hash of text and conversion method.
+    """
+    from garage.cache import s2hex
+    return s2hex('%s:%s' % (method, txt))
+
+
+def render_cache_key(txt, method, content_hash=None):
+    """
+    Return render cache key for text and conversion method.
+    """
+    if content_hash is None:
+        content_hash = get_content_hash(txt, method)
+    return '%s%s' % (HTML_RENDER_CACHE_PREFIX, content_hash)
+
+
+def txt2html(txt, method, cache=None):
+    """
+    Convert text to html using conversion method.
+    * converted html is cached if cache is enabled (see
+      ``get_render_cache``).
+
+    :param txt: text to convert
+    :param method: conversion method (e.g. MARKDOWN_CONVERSION)
+    :param cache: 'local', 'django', cache object or False to disable
+           caching (default: HTML_RENDER_CACHE setting)
+    :returns: converted html
+    """
     try:
         assert txt is not None and len(txt) > 0
-        if method == MARKDOWN_CONVERSION:
-            txt = markdown(txt)
-        elif method == TEXTILE_CONVERSION:
-            txt = textile(txt)
-        elif method == SIMPLE_CONVERSION:
-            txt = markdown(txt)
-        else:
-            # NO_CONVERSION
-            pass
+        converter = get_converter(method)
+        if converter is not None:
+            render_cache = get_render_cache(cache)
+            if render_cache is None:
+                txt = converter(txt)
+            else:
+                key = render_cache_key(txt, method)
+                html = render_cache.get(key)
+                if html is None:
+                    html = converter(txt)
+                    render_cache.set(key, html)
+                txt = html
     except (TypeError, AssertionError):
         pass
     return txt
 
 
+# batch conversion
+# * for re-rendering large numbers of entries (e.g. after changing
+#   converter extensions); texts are converted in chunks using a pool
+#   of worker processes.
+
+# number of texts per chunk sent to a worker process
+RENDER_CHUNKSIZE = 100
+
+# yielded by ``render_many`` in place of html for unchanged items
+# (html is None for None texts, as with ``txt2html``)
+RENDER_UNCHANGED = object()
+
+def _render_chunk(texts, method):
+    """
+    Convert a list of texts to html (runs in worker processes).
+    """
+    return [txt2html(txt, method, cache=False) for txt in texts]
+
+
+def render_many(items, method, workers=None, chunksize=None, cache=None):
+    """
+    Convert texts to html using a pool of worker processes.
+    * items can be texts or (text, content_hash) tuples, where
+      content_hash is the hash returned for the text by a previous
+      call; items whose hash is unchanged are skipped.
+    * html found in the render cache (see ``get_render_cache``) is not
+      converted again; converted html is added to the cache.
+    * results are yielded in the same order as the items.
+
+    Usage:
+
+    entries = Entry.objects.values_list('body', 'body_hash').iterator()
+    for body_hash, html in render_many(entries, MARKDOWN_CONVERSION):
+        if html is not RENDER_UNCHANGED:
+            ...
+
+    :param items: iterable of texts or (text, content_hash) tuples
+    :param method: conversion method (e.g. MARKDOWN_CONVERSION)
+    :param workers: number of worker processes (default: number of CPUs)
+    :param chunksize: number of texts to send to a worker at a time
+           (default: RENDER_CHUNKSIZE)
+    :param cache: render cache (see ``txt2html``)
+    :returns: generator yielding (content_hash, html) tuples (html is
+              RENDER_UNCHANGED if the item is unchanged)
+    """
+    import itertools
+    from collections import deque
+    from garage.utils import parallel_map
+
+    if not chunksize:
+        chunksize = RENDER_CHUNKSIZE
+    render_cache = get_render_cache(cache)
+    chunks = deque()
+
+    def batches():
+        # yield texts in each chunk that need to be converted
+        source = iter(items)
+        while True:
+            chunk = list(itertools.islice(source, chunksize))
+            if not chunk:
+                return
+            entries = []
+            todo = []
+            todo_index = {}
+            for item in chunk:
+                if isinstance(item, (tuple, list)):
+                    txt, previous_hash = item
+                else:
+                    txt, previous_hash = item, None
+                content_hash = get_content_hash(txt, method)
+                html = None
+                if content_hash != previous_hash:
+                    if render_cache is not None:
+                        key = render_cache_key(txt, method, content_hash)
+                        html = render_cache.get(key)
+                    if html is None and content_hash not in todo_index:
+                        todo_index[content_hash] = len(todo)
+                        todo.append(txt)
+                entries.append((content_hash, previous_hash, html))
+            chunks.append((entries, todo_index))
+            yield todo
+
+    results = parallel_map(_render_chunk, batches(), workers, args=(method,))
+    for converted in results:
+        entries, todo_index = chunks.popleft()
+        for content_hash, previous_hash, html in entries:
+            if content_hash == previous_hash:
+                yield (content_hash, RENDER_UNCHANGED)
+                continue
+            if html is None:
+                html = converted[todo_index[content_hash]]
+                if render_cache is not None:
+                    key = render_cache_key(None, method, content_hash)
+                    render_cache.set(key, html)
+            yield (content_hash, html)
+
+
 def get_cvt_method(name):
     """
     Get conversion method "code" corresponding to name
@@ -187,36 +516,796 @@ def get_cvt_method_name(code):
     return name
 
 
-def to_html(txt, cvt_method='markdown'):
+def to_html(txt, cvt_method='markdown', cache=None):
     """
     Convert text block to html
     * cvt_method is name of method (markdown, textile, or none)
     * cf. txt2html where method is the conversion "code" (number)
     """
-    return txt2html(txt, get_cvt_method(cvt_method))
+    return txt2html(txt, get_cvt_method(cvt_method), cache=cache)
 
 
 # html-to-text utility function
 
-def html_to_text(html):
+class TolerantHTMLParser(HTMLParser):
+    """
+    HTMLParser that treats malformed markup as text.
+    * the Python 2 ``HTMLParser`` raises ``HTMLParseError`` on some
+      malformed markup (e.g. an unclosed '<![' marked section); here
+      the '<' (or '&') that starts the offending construct is passed
+      to ``handle_data`` and parsing resumes after it.
+    * entity and character references are decoded and passed to
+      ``handle_data``; references without a terminating ';' (e.g.
+      'AT&T') and unknown or invalid references are passed as they
+      appear in the source.
+    """
+    # reference being parsed (see updatepos)
+    reference = False
+
+    def handle_entityref(self, name):
+        # the source of the reference ('&name' or '&name;') is only
+        # known when the parser moves past it
+        self.reference = True
+
+    def handle_charref(self, name):
+        self.reference = True
+
+    def updatepos(self, i, j):
+        if self.reference:
+            self.reference = False
+            self.handle_data(self.decode_reference(self.rawdata[i:j]))
+        return HTMLParser.updatepos(self, i, j)
+
+    def decode_reference(self, ref):
+        """Return character for reference or ref if it can't be decoded."""
+        if ref[-1:] != ';':
+            return ref
+        try:
+            if ref[:3] in ('&#x', '&#X'):
+                return six.unichr(int(ref[3:-1], 16))
+            elif ref[:2] == '&#':
+                return six.unichr(int(ref[2:-1]))
+            return six.unichr(name2codepoint[ref[1:-1]])
+        except (KeyError, ValueError, OverflowError):
+            return ref
+
+    def parse_starttag(self, i):
+        try:
+            return HTMLParser.parse_starttag(self, i)
+        except HTMLParseError:
+            return self.parse_error(i)
+
+    def parse_html_declaration(self, i):
+        try:
+            return HTMLParser.parse_html_declaration(self, i)
+        except HTMLParseError:
+            return self.parse_error(i)
+
+    def parse_error(self, i):
+        """Handle first character of malformed construct as text."""
+        self.handle_data(self.rawdata[i])
+        return i + 1
+
+    def close(self):
+        try:
+            HTMLParser.close(self)
+        except HTMLParseError:
+            # EOF in middle of entity or char ref (e.g. 'a &b')
+            rawdata = self.rawdata
+            self.rawdata = ''
+            self.handle_data(rawdata[rawdata.rfind('&'):])
+
+
+class HtmlTextParser(TolerantHTMLParser):
+    """
+    Streaming html tokenizer that collects the text content of html.
+    * tags are dropped and entity/character references are decoded.
+    * content of script and style elements is skipped.
+    * feed html in chunks with ``feed`` and retrieve the text
+      collected so far with ``pop_text``.
+    """
+    skip_tags = ('script', 'style')
+
+    def __init__(self):
+        TolerantHTMLParser.__init__(self)
+        self.text = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self.skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.skip_tags and self.skip > 0:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.text.append(data)
+
+    def pop_text(self):
+        """Return text collected so far and reset buffer."""
+        text = ''.join(self.text)
+        self.text = []
+        return text
+
+
+def iter_html_text(html):
+    """
+    Convert html to text in a single pass.
+    * html can be a string or an iterable of strings (e.g. a file
+      object or a generator) so large documents can be processed in
+      chunks.
+
+    :param html: html content or iterable of html chunks
+    :returns: generator yielding text fragments
+    """
+    if isinstance(html, six.string_types):
+        html = [html]
+    parser = HtmlTextParser()
+    for chunk in html:
+        parser.feed(chunk)
+        text = parser.pop_text()
+        if text:
+            yield text
+    parser.close()
+    text = parser.pop_text()
+    if text:
+        yield text
+
+
+LineBreakRegexp = re.compile(r'\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+def iter_html_lines(html, keep_blank=False):
+    """
+    Convert html to lines of text in a single pass.
+    * lines are stripped of beginning and ending white space.
+    * blank lines are dropped or, if keep_blank is True, multiple
+      blank lines are reduced to one.
+
+    :param html: html content or iterable of html chunks
+    :param keep_blank: keep (compressed) blank lines
+    :returns: generator yielding lines of text
+    """
+    pending = ''
+    blank = True
+    for text in iter_html_text(html):
+        lines = LineBreakRegexp.split(pending + text)
+        pending = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                blank = False
+                yield line
+            elif keep_blank and not blank:
+                blank = True
+                yield ''
+    line = pending.strip()
+    if line:
+        yield line
+
+
+# structured html-to-text conversion
+# * ``HtmlEventParser`` parses html in a single pass and passes start
+#   tags, end tags and (decoded) text to a formatter.
+# * formatters: 'plain' (plain text), 'markdown' (markdown-ish text)
+#   and 'tokens' (word tokens for search indexing).
+
+BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'caption', 'dd', 'div',
+    'dl', 'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main',
+    'nav', 'ol', 'p', 'pre', 'section', 'table', 'tr', 'ul',
+])
+
+HEADING_TAGS = {
+    'h1': 1,
+    'h2': 2,
+    'h3': 3,
+    'h4': 4,
+    'h5': 5,
+    'h6': 6,
+}
+
+class HtmlEventParser(HtmlTextParser):
+    """
+    Streaming html tokenizer that passes html events to a formatter.
+    * calls ``formatter.start_tag``, ``formatter.end_tag`` and
+      ``formatter.text`` (with decoded entity/character references).
+    * content of script and style elements is skipped.
+
+    :param formatter: HtmlFormatter instance
+    """
+
+    def __init__(self, formatter):
+        HtmlTextParser.__init__(self)
+        self.formatter = formatter
+
+    def handle_starttag(self, tag, attrs):
+        HtmlTextParser.handle_starttag(self, tag, attrs)
+        if not self.skip:
+            self.formatter.start_tag(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        if not self.skip and tag not in self.skip_tags:
+            self.formatter.end_tag(tag)
+        HtmlTextParser.handle_endtag(self, tag)
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.formatter.text(data)
+
+
+class HtmlFormatter(object):
+    """
+    Base class for formatters used by ``HtmlEventParser``.
+    * formatted output is appended to ``output`` and retrieved with
+      ``pop_output``.
+    """
+
+    def __init__(self):
+        self.output = []
+
+    def start_tag(self, tag, attrs):
+        pass
+
+    def end_tag(self, tag):
+        pass
+
+    def text(self, data):
+        pass
+
+    def close(self):
+        pass
+
+    def pop_output(self):
+        """Return output collected so far and reset buffer."""
+        output = self.output
+        self.output = []
+        return output
+
+
+class PlainTextFormatter(HtmlFormatter):
+    """
+    Format html as plain text.
+    * output is a list of text blocks (paragraphs, headings, list
+      items, etc.).
+    * white space is collapsed except in pre elements.
+    * list items are prefixed with bullets or numbers, table cells are
+      separated by '|' and link urls follow the link text.
+    """
+    bullet = '* '
+    quote_prefix = '    '
+    pre_prefix = ''
+
+    def __init__(self):
+        super(PlainTextFormatter, self).__init__()
+        self.lines = []
+        self.buf = []
+        self.lists = []
+        self.links = []
+        self.quote = 0
+        self.pre = 0
+        self.cells = 0
+        self.prefix = ''
+        self.heading = 0
+
+    def start_tag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.flush()
+        if tag in HEADING_TAGS:
+            self.heading = HEADING_TAGS[tag]
+        handler = getattr(self, 'start_%s' % tag, None)
+        if handler is not None:
+            handler(attrs)
+
+    def end_tag(self, tag):
+        handler = getattr(self, 'end_%s' % tag, None)
+        if handler is not None:
+            handler()
+        if tag in BLOCK_TAGS:
+            self.flush()
+
+    def text(self, data):
+        self.buf.append(data)
+
+    def close(self):
+        self.flush()
+
+    def break_line(self):
+        """End current line of text."""
+        line = ''.join(self.buf)
+        if self.pre:
+            line = line.strip('\r\n')
+        else:
+            line = ' '.join(line.split())
+        self.buf = []
+        self.links = [(href, 0) for href, _ in self.links]
+        if line:
+            self.lines.append(line)
+
+    def flush(self):
+        """End current block of text and add it to output."""
+        self.break_line()
+        if self.lines:
+            self.output.append(self.format_block(self.lines))
+        self.lines = []
+        self.prefix = ''
+        self.heading = 0
+
+    def format_block(self, lines):
+        txt = '\n'.join(lines)
+        if self.pre and self.pre_prefix:
+            txt = '\n'.join(self.pre_prefix + line
+                            for line in txt.split('\n'))
+        if self.heading:
+            txt = self.format_heading(txt, self.heading)
+        if self.prefix:
+            indent = '\n%s' % (' ' * len(self.prefix))
+            txt = self.prefix + indent.join(txt.split('\n'))
+        if self.quote:
+            prefix = self.quote_prefix * self.quote
+            txt = '\n'.join(prefix + line for line in txt.split('\n'))
+        return txt
+
+    def format_heading(self, txt, level):
+        return txt
+
+    def format_link(self, txt, href):
+        if not href or href.startswith(('#', 'javascript:')):
+            return txt
+        if not txt or txt == href:
+            return href
+        return '%s (%s)' % (txt, href)
+
+    def format_image(self, alt, src):
+        return alt
+
+    # element handlers
+
+    def start_ul(self, attrs):
+        self.lists.append(['ul', 0])
+
+    def start_ol(self, attrs):
+        self.lists.append(['ol', 0])
+
+    def end_ul(self):
+        if self.lists:
+            self.lists.pop()
+
+    end_ol = end_ul
+
+    def start_li(self, attrs):
+        indent = '  ' * max(len(self.lists) - 1, 0)
+        if self.lists and self.lists[-1][0] == 'ol':
+            self.lists[-1][1] += 1
+            self.prefix = '%s%d. ' % (indent, self.lists[-1][1])
+        else:
+            self.prefix = '%s%s' % (indent, self.bullet)
+
+    def start_blockquote(self, attrs):
+        self.quote += 1
+
+    def end_blockquote(self):
+        self.quote = max(self.quote - 1, 0)
+
+    def start_pre(self, attrs):
+        self.pre += 1
+
+    def end_pre(self):
+        self.flush()
+        self.pre = max(self.pre - 1, 0)
+
+    def start_br(self, attrs):
+        self.break_line()
+
+    def start_tr(self, attrs):
+        self.cells = 0
+
+    def start_td(self, attrs):
+        if self.cells:
+            self.buf.append(' | ')
+        self.cells += 1
+
+    start_th = start_td
+
+    def start_a(self, attrs):
+        self.links.append((attrs.get('href'), len(self.buf)))
+
+    def end_a(self):
+        if not self.links:
+            return
+        href, pos = self.links.pop()
+        txt = ''.join(self.buf[pos:])
+        link = self.format_link(' '.join(txt.split()), href)
+        if txt[:1].isspace():
+            link = ' %s' % link
+        if txt[-1:].isspace():
+            link = '%s ' % link
+        self.buf[pos:] = [link]
+
+    def start_img(self, attrs):
+        image = self.format_image(attrs.get('alt') or '', attrs.get('src'))
+        if image:
+            self.buf.append(image)
+
+
+class MarkdownFormatter(PlainTextFormatter):
+    """
+    Format html as markdown-ish text.
+    * headings, emphasis, links, images, lists, block quotes and
+      preformatted text use markdown syntax.
+    """
+    quote_prefix = '> '
+    pre_prefix = '    '
+
+    def format_heading(self, txt, level):
+        return '%s %s' % ('#' * level, txt)
+
+    def format_link(self, txt, href):
+        if not href:
+            return txt
+        return '[%s](%s)' % (txt, href)
+
+    def format_image(self, alt, src):
+        if not src:
+            return alt
+        return '![%s](%s)' % (alt, src)
+
+    def start_hr(self, attrs):
+        self.output.append('---')
+
+    def start_em(self, attrs=None):
+        self.buf.append('*')
+
+    start_i = end_em = end_i = start_em
+
+    def start_strong(self, attrs=None):
+        self.buf.append('**')
+
+    start_b = end_strong = end_b = start_strong
+
+    def start_code(self, attrs=None):
+        if not self.pre:
+            self.buf.append('`')
+
+    end_code = start_code
+
+
+WordRegexp = re.compile(r'\w+', re.U)
+
+class TokenFormatter(HtmlFormatter):
+    """
+    Format html as a stream of lowercase word tokens (e.g. for search
+    indexing).
+    * words are not split by inline elements or entity references.
+    """
+    break_tags = frozenset(['br', 'td', 'th'])
+
+    def __init__(self):
+        super(TokenFormatter, self).__init__()
+        self.pending = ''
+
+    def start_tag(self, tag, attrs):
+        if tag in BLOCK_TAGS or tag in self.break_tags:
+            self.flush()
+
+    def end_tag(self, tag):
+        if tag in BLOCK_TAGS or tag in self.break_tags:
+            self.flush()
+
+    def text(self, data):
+        data = '%s%s' % (self.pending, data.lower())
+        tokens = WordRegexp.findall(data)
+        self.pending = ''
+        if tokens and WordRegexp.match(data, len(data) - 1):
+            # last word may continue in the next text event
+            self.pending = tokens.pop()
+        self.output.extend(tokens)
+
+    def flush(self):
+        if self.pending:
+            self.output.append(self.pending)
+            self.pending = ''
+
+    def close(self):
+        self.flush()
+
+
+HTML_FORMATTERS = {
+    'plain': PlainTextFormatter,
+    'markdown': MarkdownFormatter,
+    'tokens': TokenFormatter,
+}
+
+def iter_html_format(html, formatter='plain'):
+    """
+    Convert html in a single pass using a formatter.
+    * html can be a string or an iterable of html chunks.
+
+    :param html: html content or iterable of html chunks
+    :param formatter: formatter name (see HTML_FORMATTERS) or
+           HtmlFormatter instance
+    :returns: generator yielding formatted output (text blocks or
+              tokens, depending on formatter)
+    """
+    if isinstance(formatter, six.string_types):
+        formatter = HTML_FORMATTERS[formatter]()
+    if isinstance(html, six.string_types):
+        html = [html]
+    parser = HtmlEventParser(formatter)
+    for chunk in html:
+        parser.feed(chunk)
+        for output in formatter.pop_output():
+            yield output
+    parser.close()
+    formatter.close()
+    for output in formatter.pop_output():
+        yield output
+
+
+def html_to_tokens(html):
+    """
+    Convert html to a stream of lowercase word tokens.
+    * for search indexing; no intermediate text is built.
+
+    :param html: html content or iterable of html chunks
+    :returns: generator yielding tokens
+    """
+    return iter_html_format(html, 'tokens')
+
+
+def html_to_text(html, formatter=None):
     """
     Utility function to convert html content to plain text.
-    * uses Django `strip_tags` function to convert html to text;
-    * multiple blank lines are reduced to 2;
+    * html can be a string or an iterable of html chunks (see
+      ``iter_html_lines``);
+    * blank lines are dropped and lines are separated by a single
+      blank line;
     * strips beginning and ending white space.
-    * does not perform any kind of formatting or structuring to the
-      plain text result.
+    * if formatter is None, does not perform any kind of formatting or
+      structuring to the plain text result; otherwise, blocks
+      formatted by formatter ('plain' or 'markdown', see
+      ``iter_html_format``) are separated by a single blank line.
 
     :param html: html content
+    :param formatter: formatter name or HtmlFormatter instance
     :returns: plain text content after conversion
     """
-    from garage.text_utils import tidy_txt
-    txt = tidy_txt(strip_tags(html))
-    lines = []
-    for line in txt.splitlines():
-        s = line.strip()
-        if len(s) > 0:
-            lines.append(s)
+    if formatter is None:
+        lines = iter_html_lines(html)
+    else:
+        lines = iter_html_format(html, formatter)
     txt = '\n\n'.join(lines)
     txt = '%s\n' % txt
     return txt
+
+
+# html sanitizer
+# * ``HtmlSanitizer`` parses html in a single pass and only passes
+#   through tags, attributes and url schemes allowed by a
+#   ``SanitizerPolicy``.
+# * disallowed tags are dropped (their content is kept, except for
+#   tags in SANITIZER_STRIP_CONTENT_TAGS); comments, declarations and
+#   processing instructions are dropped.
+# * text and attribute values are re-escaped and unclosed tags are
+#   closed, so the output is well-formed.
+
+SANITIZER_TAGS = (
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'cite', 'code',
+    'dd', 'del', 'div', 'dl', 'dt', 'em', 'figcaption', 'figure',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'li',
+    'ol', 'p', 'pre', 'q', 's', 'small', 'span', 'strike', 'strong',
+    'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr',
+    'u', 'ul',
+)
+
+# allowed attributes by tag ('*' for attributes allowed on all tags)
+SANITIZER_ATTRIBUTES = {
+    '*': ('class', 'title'),
+    'a': ('href', 'name', 'rel', 'target'),
+    'abbr': ('title',),
+    'blockquote': ('cite',),
+    'img': ('src', 'alt', 'width', 'height'),
+    'ol': ('start', 'type'),
+    'q': ('cite',),
+    'td': ('colspan', 'rowspan'),
+    'th': ('colspan', 'rowspan', 'scope'),
+}
+
+SANITIZER_PROTOCOLS = ('http', 'https', 'mailto', 'ftp')
+
+SANITIZER_URL_ATTRIBUTES = ('href', 'src', 'cite')
+
+SANITIZER_STRIP_CONTENT_TAGS = (
+    'script', 'style', 'iframe', 'object', 'noscript', 'template',
+)
+
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+])
+
+# tags closed implicitly by the start of another tag (e.g. '<li>one<li>two')
+IMPLIED_END_TAGS = {
+    'li': frozenset(['li']),
+    'dt': frozenset(['dt', 'dd']),
+    'dd': frozenset(['dt', 'dd']),
+    'tr': frozenset(['tr', 'td', 'th']),
+    'td': frozenset(['td', 'th']),
+    'th': frozenset(['td', 'th']),
+}
+
+SANITIZER_TEXT_TABLE = dict((ord(c), HTML_CHARS[c]) for c in '&<>')
+SANITIZER_ATTR_TABLE = dict((ord(c), HTML_CHARS[c]) for c in '&<>"')
+UrlSchemeRegexp = re.compile(r'([a-zA-Z][a-zA-Z0-9+.\-]*):')
+UrlIgnoredCharsRegexp = re.compile(r'[\x00-\x20\x7f]+')
+
+class SanitizerPolicy(object):
+    """
+    Precompiled allowlist of tags, attributes and url schemes for
+    ``HtmlSanitizer``.
+    * attributes allowed on all tags ('*') are merged into the
+      attributes allowed for each tag when the policy is created.
+
+    :param tags: list of allowed tags
+    :param attributes: dict of allowed attributes by tag
+    :param protocols: list of allowed url schemes (relative urls are
+           always allowed)
+    :param url_attributes: list of attributes containing urls
+    :param strip_content_tags: list of tags to drop with their content
+    """
+
+    def __init__(self, tags=SANITIZER_TAGS,
+                 attributes=SANITIZER_ATTRIBUTES,
+                 protocols=SANITIZER_PROTOCOLS,
+                 url_attributes=SANITIZER_URL_ATTRIBUTES,
+                 strip_content_tags=SANITIZER_STRIP_CONTENT_TAGS):
+        global_attributes = frozenset(attributes.get('*', ()))
+        self.tags = frozenset(tags)
+        self.attributes = dict(
+            (tag, global_attributes.union(attributes.get(tag, ())))
+            for tag in self.tags)
+        self.protocols = frozenset(p.lower() for p in protocols)
+        self.url_attributes = frozenset(url_attributes)
+        self.strip_content_tags = frozenset(strip_content_tags)
+
+    def allowed_url(self, url):
+        """
+        Return True if url is relative or its scheme is allowed.
+        * white space and control characters (which browsers ignore)
+          are removed before the scheme is checked.
+        """
+        m = UrlSchemeRegexp.match(UrlIgnoredCharsRegexp.sub('', url))
+        return m is None or m.group(1).lower() in self.protocols
+
+    def filter_attrs(self, tag, attrs):
+        """
+        Return allowed attributes for tag as html.
+
+        :param tag: tag name
+        :param attrs: list of (name, value) pairs
+        :returns: attributes as html string
+        """
+        allowed = self.attributes[tag]
+        result = []
+        for name, value in attrs:
+            if name not in allowed:
+                continue
+            if value is None:
+                result.append(' %s' % name)
+                continue
+            if name in self.url_attributes and not self.allowed_url(value):
+                continue
+            result.append(' %s="%s"' % (
+                name, six.text_type(value).translate(SANITIZER_ATTR_TABLE)))
+        return ''.join(result)
+
+DEFAULT_SANITIZER_POLICY = SanitizerPolicy()
+
+
+class HtmlSanitizer(TolerantHTMLParser):
+    """
+    Streaming html sanitizer.
+    * feed html in chunks with ``feed`` and retrieve the sanitized
+      html produced so far with ``pop_output``; call ``close`` at the
+      end of input to close open tags.
+
+    :param policy: SanitizerPolicy instance
+    """
+
+    def __init__(self, policy=None):
+        TolerantHTMLParser.__init__(self)
+        self.policy = policy or DEFAULT_SANITIZER_POLICY
+        self.output = []
+        self.open_tags = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.policy.strip_content_tags:
+            self.skip += 1
+        if self.skip or tag not in self.policy.tags:
+            return
+        implied = IMPLIED_END_TAGS.get(tag)
+        while implied and self.open_tags and self.open_tags[-1] in implied:
+            self.output.append('</%s>' % self.open_tags.pop())
+        self.output.append('<%s%s>' % (
+            tag, self.policy.filter_attrs(tag, attrs)))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.policy.strip_content_tags:
+            if self.skip > 0:
+                self.skip -= 1
+            return
+        if self.skip or tag not in self.open_tags:
+            return
+        # close tag (and any tags left open inside it)
+        while True:
+            open_tag = self.open_tags.pop()
+            self.output.append('</%s>' % open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.output.append(
+                six.text_type(data).translate(SANITIZER_TEXT_TABLE))
+
+    def close(self):
+        TolerantHTMLParser.close(self)
+        while self.open_tags:
+            self.output.append('</%s>' % self.open_tags.pop())
+
+    def pop_output(self):
+        """Return sanitized html produced so far and reset buffer."""
+        output = ''.join(self.output)
+        self.output = []
+        return output
+
+
+def iter_sanitize_html(html, policy=None):
+    """
+    Sanitize html in a single pass.
+    * html can be a string or an iterable of html chunks.
+
+    :param html: html content or iterable of html chunks
+    :param policy: SanitizerPolicy instance (default:
+           DEFAULT_SANITIZER_POLICY)
+    :returns: generator yielding sanitized html fragments
+    """
+    if isinstance(html, six.string_types):
+        html = [html]
+    parser = HtmlSanitizer(policy)
+    for chunk in html:
+        parser.feed(chunk)
+        output = parser.pop_output()
+        if output:
+            yield output
+    parser.close()
+    output = parser.pop_output()
+    if output:
+        yield output
+
+
+def sanitize_html(html, policy=None):
+    """
+    Remove disallowed tags, attributes and urls from html.
+    * use to clean user-submitted html (e.g. content created with the
+      VISUAL_EDITOR conversion method, which ``txt2html`` passes
+      through unchanged).
+
+    sanitized = sanitize_html(txt2html(txt, VISUAL_EDITOR))
+
+    :param html: html content or iterable of html chunks
+    :param policy: SanitizerPolicy instance (default:
+           DEFAULT_SANITIZER_POLICY)
+    :returns: sanitized html
+    """
+    return ''.join(iter_sanitize_html(html, policy))
@@ -12,14 +12,23 @@ Image-processing utility functions.
 
 from __future__ import (absolute_import, unicode_literals)
 
+import six
 import os.path
 import re
+import math
 import imghdr
 try:
     from PIL import Image
 except ImportError:
     import Image
 
+from garage.utils import (
+    DataObject,
+    LRUCache,
+    parallel_map,
+    make_dir,
+)
+
 
 
 # image utilities
@@ -33,20 +42,209 @@ Regexp = None
 DEFAULT_FNAME = 'image'
 
 
-def resize_image(img, box, fit):
+# fast mode: minimum ratio between the size of the image after
+# reduction by an integer factor and the final size (the same as
+# Pillow's ``reducing_gap``)
+REDUCING_GAP = 2.0
+
+
+def draft_image(img, box):
+    """
+    Configure JPEG decoder to decode image at a reduced scale (1/2,
+    1/4 or 1/8) that still covers box when cropped to fit.
+    * must be called before the image is loaded; has no effect on
+      formats other than JPEG.
+
+    :param img: Image - an Image-object opened with ``Image.open``
+    :param box: tuple(x, y) - dimensions of the result image
+    """
+    if img.format != 'JPEG':
+        return
+    x, y = img.size
+    w, h = box
+    scale = max(1.0 * w / x, 1.0 * h / y)
+    if scale < 0.5:
+        img.draft(img.mode, (int(math.ceil(x * scale)),
+                             int(math.ceil(y * scale))))
+
+
+def reduce_image(img, box, reducing_gap=REDUCING_GAP):
+    """
+    Reduce image size by an integer factor (by averaging blocks of
+    pixels) so it is still at least reducing_gap times the size of
+    box.
+    * a cheap first step before a high-quality resample to box.
+
+    :param img: Image - an Image-object
+    :param box: tuple(x, y) - dimensions of the result image
+    :param reducing_gap: minimum ratio between reduced and final size
+    :returns: reduced image
+    """
+    x, y = img.size
+    w, h = box
+    factor = int(min(1.0 * x / w, 1.0 * y / h) / reducing_gap)
+    if factor < 2:
+        return img
+    if hasattr(img, 'reduce'):
+        # Pillow >= 7.0
+        return img.reduce(factor)
+    box = ((x + factor - 1) // factor, (y + factor - 1) // factor)
+    return img.resize(box, Image.BOX)
+
+
+# EXIF orientation (1-8) -> transpose method to display image upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+# orientations where width and height are swapped
+ROTATED_ORIENTATIONS = frozenset([5, 6, 7, 8])
+
+# mapping of a point in the displayed image to the image as stored
+# * (swap x/y, mirror x, mirror y), applied in that order
+ORIENTATION_POINT_MAP = {
+    2: (False, True, False),
+    3: (False, True, True),
+    4: (False, False, True),
+    5: (True, False, False),
+    6: (True, False, True),
+    7: (True, True, True),
+    8: (True, True, False),
+}
+
+def get_stored_anchor(anchor, orientation):
+    """
+    Map crop anchor of the displayed image to the image as stored.
+
+    :param anchor: tuple(ax, ay) with values from 0.0 to 1.0
+    :param orientation: EXIF orientation (1-8)
+    :returns: tuple(ax, ay) for the stored image
+    """
+    ax, ay = anchor
+    if orientation not in ORIENTATION_POINT_MAP:
+        return ax, ay
+    swap, mirror_x, mirror_y = ORIENTATION_POINT_MAP[orientation]
+    if swap:
+        ax, ay = ay, ax
+    if mirror_x:
+        ax = 1.0 - ax
+    if mirror_y:
+        ay = 1.0 - ay
+    return ax, ay
+
+def get_orientation(img, orient=True):
+    """
+    Return EXIF orientation of image (1 if none or if orient is False).
+    """
+    if not orient:
+        return 1
+    return get_exif_orientation(img) or 1
+
+
+def get_oriented_size(img, orient=True):
+    """
+    Return image dimensions after orientation correction.
+    """
+    x, y = img.size
+    if get_orientation(img, orient) in ROTATED_ORIENTATIONS:
+        return y, x
+    return x, y
+
+
+# maximum dimension of downscaled image used to find crop anchor
+ANCHOR_SAMPLE_SIZE = 100
+
+def get_entropy(img):
+    """Return entropy of (grayscale) image histogram."""
+    hist = img.histogram()
+    total = float(sum(hist))
+    if not total:
+        return 0.0
+    return -sum(n / total * math.log(n / total, 2) for n in hist if n)
+
+
+def get_entropy_anchor(img, box):
+    """
+    Find crop anchor for image by trimming the edges with the least
+    detail (entropy) until the crop has the aspect ratio of box.
+    * computed on a grayscale copy at most ``ANCHOR_SAMPLE_SIZE``
+      pixels wide/high, so cost is small and independent of image size.
+
+    :param img: Image - an Image-object
+    :param box: tuple(x, y) - dimensions of the result image
+    :returns: tuple(ax, ay) - position of crop (0.0-1.0) along the
+        horizontal and vertical axes (0.5 is centered)
+    """
+    x, y = img.size
+    scale = min(1.0, 1.0 * ANCHOR_SAMPLE_SIZE / max(x, y))
+    sw, sh = max(int(x * scale), 1), max(int(y * scale), 1)
+    sample = img.resize((sw, sh), Image.BOX)
+    if sample.mode != 'L':
+        sample = sample.convert('L')
+    w, h = box
+    ratio = 1.0 * w / h
+    cw = min(sw, int(round(sh * ratio)))
+    ch = min(sh, int(round(sw / ratio)))
+    step = max(1, max(sw, sh) // 20)
+    left, top, right, bottom = 0, 0, sw, sh
+    while right - left > cw:
+        n = min(step, right - left - cw)
+        if (get_entropy(sample.crop((left, top, left + n, bottom))) <
+                get_entropy(sample.crop((right - n, top, right, bottom)))):
+            left += n
+        else:
+            right -= n
+    while bottom - top > ch:
+        n = min(step, bottom - top - ch)
+        if (get_entropy(sample.crop((left, top, right, top + n))) <
+                get_entropy(sample.crop((left, bottom - n, right, bottom)))):
+            top += n
+        else:
+            bottom -= n
+    ax = 1.0 * left / (sw - cw) if sw > cw else 0.5
+    ay = 1.0 * top / (sh - ch) if sh > ch else 0.5
+    return ax, ay
+
+
+def resize_image(img, box, fit, fast=False, orient=True, anchor=None):
     """
     Downsample image and resize to 'box' dimensions.
 
     :param img: Image - an Image-object
     :param box: tuple(x, y) - the bounding box of the result image
     :param fit: boolean - crop the image to fill the box
+    :param fast: boolean - reduce image by an integer factor before
+        resampling (faster for large reductions, with slightly lower
+        quality; see ``reduce_image``)
+    :param orient: boolean - rotate/flip image according to its EXIF
+        orientation; the image is cropped and resized in its stored
+        orientation and only the result is transposed
+    :param anchor: position of crop if fit is True - None (centered),
+        tuple(ax, ay) with values from 0.0 (left/top) to 1.0
+        (right/bottom) of the displayed (oriented) image or 'entropy'
+        (see ``get_entropy_anchor``)
     """
+    orientation = get_orientation(img, orient)
+    if orientation in ROTATED_ORIENTATIONS:
+        box = (box[1], box[0])
     w, h = box
 
     def f2i(n):
         return int(round(n))
 
     if fit:
+        if anchor is None:
+            ax, ay = 0.5, 0.5
+        elif anchor == 'entropy':
+            ax, ay = get_entropy_anchor(img, box)
+        else:
+            ax, ay = get_stored_anchor(anchor, orientation)
         x, y = img.size
         src_ratio = 1.0 * x/y
         dst_ratio = 1.0 * w/h
@@ -58,9 +256,9 @@ def resize_image(img, box, fit):
             dy = x / dst_ratio - y
         x += dx
         y += dy
-        a0 = 1.0 * abs(dx/2)
+        a0 = 1.0 * abs(dx) * ax
         a1 = a0 + x
-        b0 = 1.0 * abs(dy/2)
+        b0 = 1.0 * abs(dy) * ay
         b1 = b0 + y
         a0 = f2i(a0)
         a1 = f2i(a1)
@@ -69,45 +267,259 @@ def resize_image(img, box, fit):
         crop_coordinates = (a0, b0, a1, b1)
         img = img.crop(crop_coordinates)
 
+    if fast:
+        img = reduce_image(img, box)
     img = img.resize(box, Image.ANTIALIAS)
+    if orientation in ORIENTATION_TRANSPOSE:
+        img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
     return img
 
 
 def get_image_size(image_file):
-    img = Image.open(image_file)
-    imgw, imgh = img.size
-    return imgw, imgh
-
-
-def create_thumb(image_file, w, h, quality, dst, fbase, fext):
     """
-    Uses resize function above.
+    Return image dimensions.
+    * for paths, uses the cached header-only ``probe_image``.
+
+    :param image_file: path or file object of image
+    :returns: tuple(width, height)
     """
-    quality = int(quality)
+    if isinstance(image_file, six.string_types):
+        info = probe_image(image_file)
+        if info is None:
+            raise IOError('Cannot identify image file: %s' % image_file)
+        return info.width, info.height
+    with Image.open(image_file) as img:
+        return img.size
+
 
-    img = Image.open(image_file)
+def get_thumb_size(img_size, w, h):
+    """
+    Calculate thumbnail dimensions.
+    * if either width or height is 0 or None, it is calculated from
+      the other dimension and the aspect ratio of the image.
 
-    imgw, imgh = img.size
+    :param img_size: tuple(x, y) - dimensions of the original image
+    :param w: thumbnail width
+    :param h: thumbnail height
+    :returns: tuple(w, h) of thumbnail dimensions
+    """
+    imgw, imgh = img_size
     r = (1.0 * imgw) / imgh
     if not w:
         w = round(r * float(h))
     if not h:
         h = round(float(w) / r)
+    return int(w), int(h)
 
-    w = int(w)
-    h = int(h)
 
-    img = resize_image(img, (w, h,), True)
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
+def save_thumb(img, w, h, quality, dst, fbase, fext, options=None):
+    """
+    Save thumbnail as ``dst/fbase-WxH.ext``.
+    * image format is determined by fext, which can also be one of
+      the output formats handled by ``encode_image`` (e.g. 'png8' or
+      'auto'); ext is the extension of the encoded format.
 
-    filename = '%s-%dx%d.%s' % (fbase, w, h, fext)
-    output = os.path.join(dst, filename)
-    img.save(output, quality=quality)
+    :returns: path of thumbnail
+    """
+    encoded = encode_image(img, fext, quality, options)
+    output = os.path.join(dst, get_thumb_filename(fbase, w, h, encoded.ext))
+    with open(output, 'wb') as f:
+        f.write(encoded.data)
     return output
 
 
+# output formats
+# * formats are file extensions of image formats supported by PIL
+#   and 'png8' (palette png).
+# * 'auto' selects the smallest encoding of THUMB_AUTO_FORMATS.
+
+THUMB_FORMAT_EXTS = {
+    'png8': 'png',
+    'jpeg': 'jpg',
+}
+
+# default encoder options by output format
+THUMB_ENCODER_OPTIONS = {
+    'jpg': {'optimize': True, 'progressive': True},
+    'webp': {'method': 4},
+    'png': {'optimize': True},
+    'png8': {'optimize': True, 'colors': 256},
+}
+
+THUMB_AUTO_FORMATS = ('jpg', 'webp')
+
+# formats that can store an alpha channel
+ALPHA_FORMATS = frozenset(['png', 'png8', 'webp', 'tif'])
+
+def get_format_ext(fmt):
+    """Return file extension for output format."""
+    return THUMB_FORMAT_EXTS.get(fmt, fmt)
+
+
+def has_alpha(img):
+    """Return True if image has an alpha channel or transparency."""
+    return (img.mode in ('RGBA', 'LA') or
+            (img.mode == 'P' and 'transparency' in img.info))
+
+
+def encode_image(img, fmt, quality=DEFAULT_IMG_QUALITY, options=None,
+                 auto_formats=THUMB_AUTO_FORMATS):
+    """
+    Encode image in output format.
+    * images are converted to RGB (or RGBA if the image has an alpha
+      channel and the format supports it).
+    * 'png8' images are quantized to a palette of at most 256 (option
+      'colors') colors.
+    * if fmt is 'auto', the image is encoded in each of auto_formats
+      (skipping formats without alpha support for images with alpha
+      and formats PIL cannot write) and the smallest result is
+      returned.
+
+    :param img: Image - an Image-object
+    :param fmt: output format (see ``THUMB_ENCODER_OPTIONS``) or 'auto'
+    :param quality: image quality (for lossy formats)
+    :param options: encoder options (override THUMB_ENCODER_OPTIONS)
+    :param auto_formats: formats to choose from if fmt is 'auto'
+    :returns: DataObject with ``data``, ``format``, ``ext``, ``size``
+              (bytes) and ``sizes`` (dict of sizes of all encodings
+              tried, by format)
+    """
+    if fmt == 'auto':
+        alpha = has_alpha(img)
+        results = []
+        for f in auto_formats:
+            if alpha and f not in ALPHA_FORMATS:
+                continue
+            if get_img_format(get_format_ext(f)) not in Image.SAVE:
+                continue
+            results.append(encode_image(img, f, quality, options))
+        if not results:
+            raise ValueError('No usable output format: %s'
+                             % ', '.join(auto_formats))
+        encoded = min(results, key=lambda r: r.size)
+        encoded.sizes = dict((r.format, r.size) for r in results)
+        return encoded
+
+    ext = get_format_ext(fmt)
+    opts = dict(THUMB_ENCODER_OPTIONS.get(fmt, {}))
+    if options:
+        opts.update(options)
+    colors = opts.pop('colors', 256)
+    mode = 'RGBA' if ext in ALPHA_FORMATS and has_alpha(img) else 'RGB'
+    if img.mode != mode:
+        img = img.convert(mode)
+    if fmt == 'png8':
+        # fast octree is the only method that supports RGBA images
+        img = img.quantize(colors, method=2 if mode == 'RGBA' else None)
+    output = six.BytesIO()
+    img.save(output, format=get_img_format(ext), quality=int(quality),
+             **opts)
+    data = output.getvalue()
+    return DataObject(data=data, format=fmt, ext=ext, size=len(data),
+                      sizes={fmt: len(data)})
+
+
+def get_thumb_filename(fbase, w, h, fext):
+    """Return thumbnail file name (``fbase-WxH.fext``)."""
+    return '%s-%dx%d.%s' % (fbase, w, h, fext)
+
+
+def get_thumb_specs(img_size, sizes, quality, fext):
+    """
+    Return list of thumbnail settings (w, h, quality, ext) for sizes
+    (see ``generate_thumbs``).
+
+    :param img_size: tuple(x, y) - dimensions of the original image
+    :param sizes: list of tuples (width, height[, quality[, ext]])
+    :param quality: default image quality
+    :param fext: default file extension
+    :returns: list of tuples (w, h, quality, ext)
+    """
+    specs = []
+    for size in sizes:
+        size = tuple(size) + (None, None)
+        w, h = get_thumb_size(img_size, size[0], size[1])
+        specs.append((w, h, size[2] or quality, size[3] or fext))
+    return specs
+
+
+def create_thumb(image_file, w, h, quality, dst, fbase, fext, fast=False,
+                 anchor=None, options=None):
+    """
+    Uses resize function above.
+    * if fast is True, JPEG images are decoded at a reduced scale
+      (see ``draft_image``) and reduced by an integer factor before
+      resampling (see ``reduce_image``), trading some quality for
+      speed and memory.
+    * images are rotated according to their EXIF orientation and
+      cropped at anchor (see ``resize_image``).
+    * fext can be any output format (see ``encode_image``) and
+      options are passed to the encoder.
+    """
+    img, w, h = make_thumb(image_file, w, h, fast=fast, anchor=anchor)
+    return save_thumb(img, w, h, quality, dst, fbase, fext, options)
+
+
+def make_thumb(image_file, w, h, fast=False, anchor=None):
+    """
+    Open image and resize (crop to fit) to thumbnail size.
+
+    :param image_file: path, file object or bytes of image
+    :param w: thumbnail width (see ``get_thumb_size``)
+    :param h: thumbnail height (see ``get_thumb_size``)
+    :param fast: trade quality for speed (see ``create_thumb``)
+    :param anchor: crop anchor (see ``resize_image``)
+    :returns: tuple (thumbnail image, width, height)
+    """
+    return thumb_image(open_image(image_file), w, h, fast=fast,
+                       anchor=anchor)
+
+
+def thumb_image(img, w, h, fast=False, anchor=None):
+    """
+    Resize (crop to fit) image opened with ``open_image`` to thumbnail
+    size (see ``make_thumb``).
+    """
+    w, h = get_thumb_size(get_oriented_size(img), w, h)
+    if fast:
+        if get_orientation(img) in ROTATED_ORIENTATIONS:
+            draft_image(img, (h, w))
+        else:
+            draft_image(img, (w, h))
+    img = resize_image(img, (w, h,), True, fast=fast, anchor=anchor)
+    return img, w, h
+
+
+def open_image(image_file):
+    """
+    Open image from path, file object (e.g. an uploaded file) or bytes.
+    * file objects are rewound if possible.
+    * on Python 2, byte strings are treated as image data if they
+      contain null bytes (which paths cannot contain) and as paths
+      otherwise.
+
+    :param image_file: path, file-like object or bytes
+    :returns: Image object
+    """
+    if isinstance(image_file, six.binary_type) and (
+            six.PY3 or b'\0' in image_file):
+        image_file = six.BytesIO(image_file)
+    elif hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return Image.open(image_file)
+
+
 def get_file_basename(f, default=DEFAULT_FNAME):
+    """
+    Return base name of image file minus the image extension and
+    -WWWxHHH (or _WWWxHHH) dimensions suffix.
+    * e.g. 'img/tests/rodents-600x338.jpg' -> 'rodents'
+    * returns default if the file name has no extension.
+
+    :param f: file name or path
+    :param default: name to return if file name has no extension
+    :returns: base name
+    """
     global Regexp
     if Regexp is None:
         Regexp = [re.compile(r, re.I) for r in RE_PATS]
@@ -119,10 +531,41 @@ def get_file_basename(f, default=DEFAULT_FNAME):
     return default
 
 
+def get_file_basenames(filenames, default=DEFAULT_FNAME):
+    """
+    Return base names for list of file names (e.g. a directory
+    listing; see ``get_file_basename``).
+
+    :param filenames: iterable of file names or paths
+    :param default: name to return for file names without extension
+    :returns: list of base names
+    """
+    return [get_file_basename(f, default) for f in filenames]
+
+
+# file extensions for PIL image formats
+IMG_FORMAT_EXTS = {
+    'GIF': 'gif',
+    'PBM': 'pbm',
+    'PGM': 'pgm',
+    'PPM': 'ppm',
+    'TIFF': 'tif',
+    'XBM': 'xbm',
+    'JPEG': 'jpg',
+    'BMP': 'bmp',
+    'PNG': 'png',
+    'WEBP': 'webp',
+}
+
 def get_img_ext(path, default_ext='unknown'):
     """
     Detect image type from file path and return file extension.
+    * uses the cached ``probe_image`` and falls back on ``imghdr`` for
+      image types PIL cannot read.
     """
+    info = probe_image(path)
+    if info is not None and info.ext:
+        return info.ext
     imgtype = imghdr.what(path)
     suffix = {
         'rgb': 'rgb',
@@ -140,10 +583,594 @@ def get_img_ext(path, default_ext='unknown'):
     return suffix.get(imgtype, default_ext)
 
 
-def generate_thumb(img_file, width, height, quality, dest_dir):
+def get_img_format(ext, default=None):
+    """
+    Return PIL image format for file extension (e.g. 'JPEG' for 'jpg').
+    """
+    Image.init()
+    return Image.EXTENSION.get('.%s' % ext.lower(), default)
+
+
+def create_thumb_io(image_file, w, h, quality=DEFAULT_IMG_QUALITY, ext=None,
+                    fast=False, options=None):
+    """
+    Create thumbnail in memory (without temporary files).
+
+    data = request.FILES['image']
+    thumb, w, h, ext = create_thumb_io(data, 300, 200)
+
+    :param image_file: path, file object or bytes of image
+    :param w: thumbnail width (see ``get_thumb_size``)
+    :param h: thumbnail height (see ``get_thumb_size``)
+    :param quality: image quality
+    :param ext: file extension (image format) of thumbnail or output
+           format (see ``encode_image``; default: extension of the
+           original image type)
+    :param fast: trade quality for speed (see ``create_thumb``)
+    :param options: encoder options (see ``encode_image``)
+    :returns: tuple (BytesIO with thumbnail data, width, height, ext)
+    """
+    img = open_image(image_file)
+    if ext is None:
+        ext = IMG_FORMAT_EXTS.get(img.format, 'jpg')
+    img, w, h = thumb_image(img, w, h, fast=fast)
+    encoded = encode_image(img, ext, quality, options)
+    return six.BytesIO(encoded.data), w, h, encoded.ext
+
+
+def create_thumb_storage(image_file, w, h, dest_dir, fbase=None,
+                         quality=DEFAULT_IMG_QUALITY, ext=None, fast=False,
+                         storage=None, options=None):
+    """
+    Create thumbnail and save it with a Django storage backend.
+    * thumbnail is saved as ``dest_dir/fbase-WxH.ext`` (the storage
+      backend may change the name to avoid overwriting files).
+
+    :param image_file: path, file object or bytes of image
+    :param w: thumbnail width (see ``get_thumb_size``)
+    :param h: thumbnail height (see ``get_thumb_size``)
+    :param dest_dir: directory (in storage) to save thumbnail in
+    :param fbase: base name of thumbnail (default: base name of
+           image_file or of its ``name`` attribute)
+    :param quality: image quality
+    :param ext: file extension (image format) of thumbnail
+    :param fast: trade quality for speed (see ``create_thumb``)
+    :param storage: storage backend (default: ``default_storage``)
+    :param options: encoder options (see ``encode_image``)
+    :returns: name of saved thumbnail
+    """
+    from django.core.files.base import ContentFile
+    if storage is None:
+        from django.core.files.storage import default_storage as storage
+    if fbase is None:
+        if isinstance(image_file, six.string_types):
+            name = image_file
+        else:
+            name = getattr(image_file, 'name', None) or ''
+        fbase = get_file_basename(name)
+    output, w, h, ext = create_thumb_io(image_file, w, h, quality, ext, fast,
+                                        options)
+    filename = get_thumb_filename(fbase, w, h, ext)
+    name = '%s/%s' % (dest_dir.rstrip('/'), filename) if dest_dir else filename
+    return storage.save(name, ContentFile(output.getvalue()))
+
+
+# header-only image probing
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# number of image probe results to cache
+PROBE_CACHE_SIZE = 10000
+
+_probe_cache = LRUCache(PROBE_CACHE_SIZE)
+
+def get_exif_orientation(img):
+    """
+    Return EXIF orientation (1-8) of image or None if not available.
+    * EXIF data is read from the image header; pixel data is not
+      loaded.
+    """
+    try:
+        if hasattr(img, 'getexif'):
+            exif = img.getexif()
+        else:
+            exif = img._getexif() or {}
+        return exif.get(EXIF_ORIENTATION_TAG)
+    except (AttributeError, KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def _probe_image(path):
+    """
+    Read image header and return image info or None if file is not
+    an image (uncached, see ``probe_image``).
+    """
+    try:
+        with open(path, 'rb') as f:
+            img = Image.open(f)
+            width, height = img.size
+            return DataObject(
+                format=img.format,
+                ext=IMG_FORMAT_EXTS.get(img.format),
+                width=width,
+                height=height,
+                mode=img.mode,
+                orientation=get_exif_orientation(img))
+    except (IOError, OSError, SyntaxError, ValueError):
+        return None
+
+
+def _probe_cache_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_mtime, st.st_size)
+
+
+def probe_image(path):
+    """
+    Return format, dimensions, mode and EXIF orientation of an image.
+    * only the image header is read (pixel data is not decoded) and the
+      file is closed before returning.
+    * results are cached by (path, mtime, size).
+
+    :param path: path of image file
+    :returns: DataObject with ``format``, ``ext``, ``width``,
+              ``height``, ``mode`` and ``orientation`` or None if file
+              is not a readable image
+    """
+    key = _probe_cache_key(path)
+    if key is None:
+        return None
+    info = _probe_cache.get(key)
+    if info is None:
+        info = _probe_image(path)
+        if info is not None:
+            _probe_cache.set(key, info)
+    return info
+
+
+def probe_images(paths, workers=None):
+    """
+    Probe many image files (e.g. all files in a media directory) with
+    a pool of worker processes.
+    * cached results are returned without probing files again.
+
+    :param paths: iterable of image paths
+    :param workers: number of worker processes (default: number of
+           CPUs; see ``garage.utils.parallel_map``)
+    :returns: generator yielding tuples (path, info) in the same order
+              as paths (see ``probe_image`` for info)
+    """
+    from collections import deque
+    pending = deque()
+
+    def misses():
+        for path in paths:
+            key = _probe_cache_key(path)
+            info = None if key is None else _probe_cache.get(key)
+            miss = key is not None and info is None
+            pending.append((path, key, info, miss))
+            if miss:
+                yield path
+
+    for info in parallel_map(_probe_image, misses(), workers=workers):
+        # pass through cached results queued before the probed path
+        path, key, cached, miss = pending.popleft()
+        while not miss:
+            yield path, cached
+            path, key, cached, miss = pending.popleft()
+        if info is not None:
+            _probe_cache.set(key, info)
+        yield path, info
+    for path, key, cached, miss in pending:
+        yield path, cached
+
+
+def generate_thumb(img_file, width, height, quality, dest_dir, fast=False):
     """
     Process image file and create thumbnail according to parameters.
     """
     fbase = get_file_basename(img_file)
     fext = get_img_ext(img_file)
-    return create_thumb(img_file, width, height, quality, dest_dir, fbase, fext)
+    return create_thumb(img_file, width, height, quality, dest_dir,
+                        fbase, fext, fast=fast)
+
+
+def generate_thumbs(img_file, sizes, dest_dir, quality=DEFAULT_IMG_QUALITY,
+                    fast=False, anchor=None):
+    """
+    Create thumbnails in several sizes from an image file.
+    * the image is decoded once and downsampled to the smallest
+      intermediate image that covers all sizes; every thumbnail is
+      derived from the intermediate image.
+    * sizes are tuples (width, height[, quality[, ext]]); width or
+      height can be 0 (see ``get_thumb_size``), quality defaults to
+      ``quality`` and ext (which determines the image format) to the
+      extension of the original image type.
+
+    thumbs = generate_thumbs(path, [(1200, 675), (600, 338, 85),
+                                    (150, 150, 70, 'png')], dest_dir)
+
+    :param img_file: path of image file
+    :param sizes: list of thumbnail sizes and settings
+    :param dest_dir: directory to write thumbnails to
+    :param quality: default image quality
+    :param fast: trade quality for speed (see ``create_thumb``)
+    :param anchor: crop anchor (see ``resize_image``)
+    :returns: list of thumbnail paths (in the same order as sizes)
+    """
+    fbase = get_file_basename(img_file)
+    with Image.open(img_file) as img:
+        fext = IMG_FORMAT_EXTS.get(img.format) or get_img_ext(img_file)
+        thumbs = get_thumb_specs(get_oriented_size(img), sizes, quality,
+                                 fext)
+        # intermediate image: scale down to the largest scale needed
+        # (cropping to fit a box needs max(w/x, h/y))
+        x, y = get_oriented_size(img)
+        scale = max([max(1.0 * w / x, 1.0 * h / y)
+                     for w, h, _, _ in thumbs] or [1.0])
+        x, y = img.size
+        box = (int(math.ceil(x * scale)), int(math.ceil(y * scale)))
+        if fast:
+            draft_image(img, box)
+        if img.mode in ('1', 'P'):
+            # palette images can only be resampled with NEAREST;
+            # other modes are converted by ``encode_image``
+            img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+        if scale < 1.0:
+            if fast:
+                img = reduce_image(img, box)
+            img = img.resize(box, Image.ANTIALIAS)
+        output = []
+        for w, h, q, ext in thumbs:
+            thumb = resize_image(img, (w, h), True, fast=fast,
+                                 anchor=anchor)
+            output.append(save_thumb(thumb, w, h, q, dest_dir, fbase, ext))
+    return output
+
+
+# batch thumbnail processing
+
+IMG_FILE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.tif', '.tiff', '.bmp')
+
+# file (in destination directory) to store content hashes of images
+THUMBS_MANIFEST = '.thumbs.json'
+
+# number of images a worker process handles before it is replaced
+THUMBS_MAX_TASKS_PER_CHILD = 100
+
+def iter_image_files(root, exts=IMG_FILE_EXTS):
+    """
+    Walk directory and yield paths of image files (by extension).
+
+    :param root: directory path
+    :param exts: list of file extensions (lowercase, with dot)
+    :returns: generator yielding file paths
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in exts:
+                yield os.path.join(dirpath, filename)
+
+
+def get_file_hash(path, blocksize=65536):
+    """Return sha1 hash (in hex) of file content."""
+    import hashlib
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _batch_thumbs(item, sizes, quality, fast, check):
+    """
+    Create thumbnails for one image unless they are up to date (worker
+    function for ``generate_thumbs_batch``).
+
+    :param item: tuple (path, dest_dir, hash of image when thumbnails
+           were last created)
+    :returns: DataObject with result
+    """
+    path, dest_dir, prev_hash = item
+    result = DataObject(path=path, status='failed', error=None, hash=None,
+                        thumbs=[], bytes_in=0, bytes_out=0)
+    # catch all errors so one bad image does not stop the batch
+    try:
+        info = _probe_image(path)
+        if info is None:
+            raise IOError('Cannot identify image file: %s' % path)
+        result.bytes_in = os.path.getsize(path)
+        fbase = get_file_basename(path)
+        # thumbnail sizes are calculated from the oriented size
+        size = (info.width, info.height)
+        if info.orientation in ROTATED_ORIENTATIONS:
+            size = (info.height, info.width)
+        specs = get_thumb_specs(size, sizes, quality,
+                                info.ext or get_img_ext(path))
+        thumbs = []
+        for w, h, _, fmt in specs:
+            # with 'auto', the thumbnail can have any of the extensions
+            formats = THUMB_AUTO_FORMATS if fmt == 'auto' else (fmt,)
+            for f in formats:
+                thumb = os.path.join(dest_dir, get_thumb_filename(
+                    fbase, w, h, get_format_ext(f)))
+                if os.path.isfile(thumb):
+                    break
+            thumbs.append(thumb)
+        up_to_date = all(os.path.isfile(thumb) for thumb in thumbs)
+        if check == 'hash':
+            result.hash = get_file_hash(path)
+            up_to_date = up_to_date and result.hash == prev_hash
+        elif up_to_date:
+            mtime = os.path.getmtime(path)
+            up_to_date = all(os.path.getmtime(thumb) >= mtime
+                             for thumb in thumbs)
+        if up_to_date:
+            result.status = 'skipped'
+        else:
+            make_dir(dest_dir)
+            thumbs = generate_thumbs(path, sizes, dest_dir, quality, fast)
+            result.status = 'created'
+        result.thumbs = thumbs
+        result.bytes_out = sum(os.path.getsize(thumb) for thumb in thumbs)
+    except Exception as e:
+        result.status = 'failed'
+        result.error = '%s: %s' % (e.__class__.__name__, e)
+    return result
+
+
+def generate_thumbs_batch(source, sizes, dest_dir,
+                          quality=DEFAULT_IMG_QUALITY, fast=False,
+                          check='mtime', workers=None, progress=None):
+    """
+    Create thumbnails for many images with a pool of worker processes.
+    * source is a directory (image files are found with
+      ``iter_image_files`` and thumbnails are written to the same
+      relative sub-directories in dest_dir) or an iterable of paths
+      (thumbnails are written to dest_dir).
+    * images with up-to-date thumbnails are skipped; check is 'mtime'
+      (thumbnails are newer than the image) or 'hash' (image content
+      has not changed since thumbnails were created; hashes are stored
+      in ``THUMBS_MANIFEST`` in dest_dir).
+    * paths are read as results are consumed and worker processes are
+      replaced after ``THUMBS_MAX_TASKS_PER_CHILD`` images, so memory
+      use is bounded.
+
+    report = generate_thumbs_batch('/media/photos', [(1200, 675),
+                                   (150, 150)], '/media/thumbs')
+
+    :param source: directory path or iterable of image paths
+    :param sizes: list of thumbnail sizes (see ``generate_thumbs``)
+    :param dest_dir: directory to write thumbnails to
+    :param quality: default image quality
+    :param fast: trade quality for speed (see ``create_thumb``)
+    :param check: 'mtime' or 'hash'
+    :param workers: number of worker processes (default: number of
+           CPUs)
+    :param progress: function called with the report after each image
+    :returns: DataObject report with counts of ``created``,
+              ``skipped`` and ``failed`` images, list of ``failures``
+              (path, error), ``bytes_in`` (images processed),
+              ``bytes_out`` (thumbnails), ``bytes_saved``,
+              ``elapsed`` seconds and ``throughput`` (images per
+              second)
+    """
+    import json
+    import time
+    from garage.utils import get_file_contents, write_file
+
+    if check not in ('mtime', 'hash'):
+        raise ValueError('Invalid check: %s' % check)
+    manifest_path = os.path.join(dest_dir, THUMBS_MANIFEST)
+    manifest = {}
+    if check == 'hash':
+        data = get_file_contents(manifest_path)
+        if data:
+            manifest = json.loads(data)
+
+    if isinstance(source, six.string_types):
+        root = source
+        paths = iter_image_files(root)
+    else:
+        root = None
+        paths = source
+
+    def items():
+        for path in paths:
+            dst = dest_dir
+            if root is not None:
+                reldir = os.path.relpath(os.path.dirname(path), root)
+                dst = os.path.normpath(os.path.join(dest_dir, reldir))
+            yield path, dst, manifest.get(path)
+
+    report = DataObject(created=0, skipped=0, failed=0, failures=[],
+                        bytes_in=0, bytes_out=0, bytes_saved=0,
+                        elapsed=0.0, throughput=0.0)
+    start = time.time()
+    results = parallel_map(_batch_thumbs, items(), workers=workers,
+                           args=(sizes, quality, fast, check),
+                           maxtasksperchild=THUMBS_MAX_TASKS_PER_CHILD)
+    for result in results:
+        report[result.status] += 1
+        if result.status == 'failed':
+            report.failures.append((result.path, result.error))
+        else:
+            report.bytes_in += result.bytes_in
+            report.bytes_out += result.bytes_out
+            if result.hash:
+                manifest[result.path] = result.hash
+        report.bytes_saved = report.bytes_in - report.bytes_out
+        report.elapsed = time.time() - start
+        if report.elapsed > 0:
+            report.throughput = (
+                report.created + report.skipped + report.failed
+            ) / report.elapsed
+        if progress is not None:
+            progress(report)
+
+    if check == 'hash':
+        make_dir(dest_dir)
+        write_file(manifest_path,
+                   six.text_type(json.dumps(manifest, indent=0)))
+    return report
+
+
+# content-addressed thumbnail cache
+
+# seconds after which a lock file is considered stale
+THUMB_LOCK_TIMEOUT = 60
+
+# seconds to wait between checks for a thumbnail being generated by
+# another process
+THUMB_LOCK_POLL_INTERVAL = 0.05
+
+_content_hashes = LRUCache(PROBE_CACHE_SIZE)
+
+def get_content_hash(path):
+    """
+    Return sha1 hash of file content.
+    * hashes are cached by (path, mtime, size) so files are only read
+      again if they change.
+    """
+    key = _probe_cache_key(path)
+    if key is None:
+        raise IOError('File not found: %s' % path)
+    content_hash = _content_hashes.get(key)
+    if content_hash is None:
+        content_hash = get_file_hash(path)
+        _content_hashes.set(key, content_hash)
+    return content_hash
+
+
+class ThumbnailCache(object):
+    """
+    Cache of thumbnails keyed by hash of image content and thumbnail
+    settings.
+    * thumbnails are stored as ``cache_dir/ab/abcdef...-WxH.ext`` so
+      images with the same file name do not collide and thumbnails of
+      changed images are never stale.
+    * an existing thumbnail is returned after a single stat; missing
+      thumbnails are generated on demand.
+    * concurrent requests (from threads or processes) for the same
+      thumbnail are de-duplicated with a lock file: one request
+      generates the thumbnail while the others wait for it.
+
+    thumbs = ThumbnailCache('/media/cache/thumbs')
+    path = thumbs.get('/media/photos/beach.jpg', 300, 200)
+
+    :param cache_dir: directory to store thumbnails in
+    :param lock_timeout: seconds after which a lock file is stale
+    """
+
+    def __init__(self, cache_dir, lock_timeout=THUMB_LOCK_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.lock_timeout = lock_timeout
+
+    def get_key(self, img_file, w, h, quality, ext, fast):
+        """Return cache key for thumbnail of image."""
+        import hashlib
+        data = '%s:%s:%s:%s:%s:%s' % (get_content_hash(img_file), w, h,
+                                      quality, ext, bool(fast))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get_path(self, img_file, w, h, quality=DEFAULT_IMG_QUALITY,
+                 ext=None, fast=False):
+        """
+        Return cache path of thumbnail (which may not exist yet).
+
+        :param img_file: path of image file
+        :param w: thumbnail width (see ``get_thumb_size``)
+        :param h: thumbnail height (see ``get_thumb_size``)
+        :param quality: image quality
+        :param ext: file extension (image format) of thumbnail
+               (default: extension of the original image type)
+        :param fast: trade quality for speed (see ``create_thumb``)
+        :returns: thumbnail path
+        """
+        if ext is None:
+            ext = get_img_ext(img_file)
+        elif ext == 'auto':
+            raise ValueError('Output format must be known for cached '
+                             'thumbnails')
+        key = self.get_key(img_file, w, h, quality, ext, fast)
+        filename = '%s-%sx%s.%s' % (key, w or 0, h or 0, get_format_ext(ext))
+        return os.path.join(self.cache_dir, key[:2], filename)
+
+    def get(self, img_file, w, h, quality=DEFAULT_IMG_QUALITY, ext=None,
+            fast=False):
+        """
+        Return path of thumbnail, generating it if necessary.
+        * see ``get_path`` for parameters.
+        """
+        thumb = self.get_path(img_file, w, h, quality, ext, fast)
+        if os.path.isfile(thumb):
+            return thumb
+        make_dir(os.path.dirname(thumb))
+        lock = '%s.lock' % thumb
+        while True:
+            if self.acquire_lock(lock):
+                try:
+                    # thumbnail may have been created while waiting
+                    if not os.path.isfile(thumb):
+                        self.generate(img_file, thumb, w, h, quality, fast,
+                                      ext)
+                finally:
+                    self.release_lock(lock)
+                return thumb
+            # thumbnail is being generated by another request
+            import time
+            time.sleep(THUMB_LOCK_POLL_INTERVAL)
+            if os.path.isfile(thumb):
+                return thumb
+            self.break_stale_lock(lock)
+
+    def generate(self, img_file, thumb, w, h, quality, fast, fmt=None):
+        """
+        Create thumbnail and move it to its cache path.
+        * the thumbnail is written to a temporary file first so it is
+          never read before it is complete.
+        * fmt is the output format (default: the format of the
+          thumbnail file extension).
+        """
+        img, w, h = make_thumb(img_file, w, h, fast=fast)
+        base, ext = os.path.splitext(thumb)
+        encoded = encode_image(img, fmt or ext[1:], quality)
+        tmp = '%s.%d.tmp%s' % (base, os.getpid(), ext)
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(encoded.data)
+            os.rename(tmp, thumb)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def acquire_lock(self, lock):
+        """Create lock file; return False if it already exists."""
+        import errno
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        os.close(fd)
+        return True
+
+    def release_lock(self, lock):
+        try:
+            os.unlink(lock)
+        except OSError:
+            pass
+
+    def break_stale_lock(self, lock):
+        """Remove lock file if it is older than lock_timeout."""
+        import time
+        try:
+            if time.time() - os.path.getmtime(lock) > self.lock_timeout:
+                os.unlink(lock)
+        except OSError:
+            pass
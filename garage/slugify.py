@@ -12,11 +12,17 @@ Functions to create slugs.
 
 from __future__ import (absolute_import, unicode_literals)
 
+import six
+import sys
 import re
 import string
 from unicodedata import normalize
 
 from django.core.exceptions import ValidationError
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    from django.test.signals import setting_changed
 
 
 # general slugify function
@@ -29,40 +35,242 @@ def strip_accents(s):
     return unicode(normalize('NFKD', unicode(s)).encode('ASCII', 'ignore'))
 
 
-def slugify(s, delete_chars=SlugDeleteChars, subst_char=SubstChar):
+def slugify(s, delete_chars=SlugDeleteChars, subst_char=SubstChar,
+            transliterate=None):
     """
     Convert (unicode) string to slug.
     * This only handles Western-language strings with very basic
-      accents.
+      accents unless a transliterate function is supplied (see
+      ``garage.transliterate``).
+    * uses a compiled ``Slugifier`` (cached per delete_chars,
+      subst_char and transliterate) to perform the conversion.
     """
-    from garage.html_utils import strip_tags, unescape
+    return get_slugifier(delete_chars, subst_char, transliterate)(s)
 
-    def convert_unwanted_chars(txt):
-        converted = []
-        for ch in txt:
+
+# compiled slugify engine
+# * regexps are compiled once and the single-character substitutions
+#   are precomputed into a translate table, so text is converted in
+#   as few passes as possible.
+
+RE_POSSESSIVE = re.compile(r"['’]s")
+RE_PERCENT = re.compile(r'([0-9\.]+)%')
+RE_AMPERSAND = re.compile(r'&(?:amp;)?')
+RE_MULTIPLE_DOTS = re.compile(r'\.\.+')
+RE_MULTIPLE_DASHES = re.compile(r'--+')
+
+class Slugifier(object):
+    """
+    Compiled slugify function.
+    * use ``get_slugifier`` to retrieve cached instances.
+
+    :param delete_chars: characters to replace with subst_char
+    :param subst_char: replacement for unwanted characters
+    :param transliterate: function to convert text to ascii (default:
+           ``strip_accents``)
+    """
+
+    def __init__(self, delete_chars=SlugDeleteChars, subst_char=SubstChar,
+                 transliterate=None):
+        if transliterate is None:
+            transliterate = strip_accents
+        self.delete_chars = delete_chars
+        self.subst_char = subst_char
+        self.transliterate = transliterate
+        self.table = self.make_table(delete_chars, subst_char)
+
+    @staticmethod
+    def make_table(delete_chars, subst_char):
+        """
+        Build translate table for single character substitutions.
+        * combines (in order): '/' to ' ', ' ' to '-', '_' to '-' and
+          delete_chars to subst_char.
+        """
+        table = {}
+        for c in set('/ _-') | set(delete_chars):
+            ch = c
+            if ch == '/':
+                ch = ' '
+            if ch == ' ':
+                ch = '-'
+            if ch == '_':
+                ch = '-'
             if ch in delete_chars:
                 ch = subst_char
-            converted.append(ch)
-        return ''.join(converted)
-
-    s = s.strip("\r\n")
-    s = s.replace("\n", " ")
-    s = strip_accents(s)
-    s = strip_tags(unescape(s))
-    s = re.sub(r"['’]s", 's', s)
-    s = re.sub(r'([0-9\.]+)%', '\\1-percent', s)
-    s = s.replace("&amp;", " and ")
-    s = s.replace("&", " and ")
-    s = s.replace("/", " ")
-    s = s.replace(" ", "-")
-    s = s.replace("_", "-")
-    s = convert_unwanted_chars(s)
-    s = re.sub(r'\.\.+', '.', s)
-    s = re.sub(r'--+', '-', s)
-    s = s.strip('.')
-    s = s.strip('-')
-    s = s.lower()
-    return s
+            if ch != c:
+                table[ord(c)] = six.text_type(ch)
+        return table
+
+    def __call__(self, s):
+        s = s.strip("\r\n")
+        s = s.replace("\n", " ")
+        s = self.transliterate(s)
+        if '&' in s or '<' in s:
+            # only text with '&' or '<' can contain entities or tags
+            from garage.html_utils import strip_tags, unescape
+            s = strip_tags(unescape(s))
+            s = RE_POSSESSIVE.sub('s', s)
+            s = RE_PERCENT.sub('\\1-percent', s)
+            s = RE_AMPERSAND.sub(' and ', s)
+        else:
+            if "'s" in s:
+                s = RE_POSSESSIVE.sub('s', s)
+            if '%' in s:
+                s = RE_PERCENT.sub('\\1-percent', s)
+        s = s.translate(self.table)
+        if '..' in s:
+            s = RE_MULTIPLE_DOTS.sub('.', s)
+        if '--' in s:
+            s = RE_MULTIPLE_DASHES.sub('-', s)
+        s = s.strip('.')
+        s = s.strip('-')
+        s = s.lower()
+        return s
+
+
+# cache of compiled slugifiers
+# * keyed by delete_chars, subst_char and transliterate
+# * the cache is reset when it holds SLUGIFIER_CACHE_SIZE instances
+#   (e.g. if a new transliterate function is created for each call).
+SLUGIFIER_CACHE_SIZE = 100
+
+_slugifiers = {}
+
+def get_slugifier(delete_chars=SlugDeleteChars, subst_char=SubstChar,
+                  transliterate=None):
+    """
+    Return compiled ``Slugifier`` for delete_chars, subst_char and
+    transliterate function.
+    * instances are created on first use and cached.
+    * delete_chars can be a string or any iterable of characters
+      (e.g. a list).
+    """
+    if not isinstance(delete_chars, six.string_types):
+        # normalize to a (hashable) string; like ``ch in delete_chars``
+        # in the original implementation, items that are not single
+        # characters never match
+        delete_chars = ''.join(c for c in delete_chars
+                               if isinstance(c, six.string_types)
+                               and len(c) == 1)
+    key = (delete_chars, subst_char, transliterate)
+    try:
+        return _slugifiers[key]
+    except KeyError:
+        if len(_slugifiers) >= SLUGIFIER_CACHE_SIZE:
+            _slugifiers.clear()
+        slugifier = Slugifier(delete_chars, subst_char, transliterate)
+        _slugifiers[key] = slugifier
+        return slugifier
+
+
+# batch slugify function
+# * input is read and processed in chunks, so large corpora (e.g.
+#   titles from a queryset iterator) are never loaded into memory all
+#   at once.
+
+# number of strings per chunk sent to a worker process
+SLUGIFY_CHUNKSIZE = 1000
+
+# number of recently created slugs slugify_many remembers
+SLUGIFY_MEMO_SIZE = 100000
+
+def _slugify_chunk(chunk, delete_chars, subst_char, transliterate=None):
+    """
+    Slugify a list of strings (runs in worker processes).
+    """
+    slugifier = get_slugifier(delete_chars, subst_char, transliterate)
+    return [slugifier(s) for s in chunk]
+
+
+def slugify_many(iterable, workers=None, chunksize=None,
+                 delete_chars=SlugDeleteChars, subst_char=SubstChar,
+                 transliterate=None, memo_size=SLUGIFY_MEMO_SIZE):
+    """
+    Convert strings to slugs using a pool of worker processes.
+    * results are yielded in the same order as the input.
+    * identical strings are only slugified once: created slugs are
+      remembered, and strings already sent to a worker are not sent
+      again while their results are pending; the memo is reset when
+      it exceeds memo_size entries, so memory use is bounded by
+      memo_size and the chunks being processed, however long the
+      input is.
+    * if workers is 1, strings are slugified in the current process.
+
+    Usage:
+
+    titles = Article.objects.values_list('title', flat=True).iterator()
+    for slug in slugify_many(titles, workers=4):
+        ...
+
+    :param iterable: strings to convert
+    :param workers: number of worker processes (default: number of CPUs)
+    :param chunksize: number of strings to send to a worker at a time
+           (default: SLUGIFY_CHUNKSIZE)
+    :param delete_chars: characters to replace with subst_char
+    :param subst_char: replacement for unwanted characters
+    :param transliterate: function to convert text to ascii (must be
+           picklable if workers > 1)
+    :param memo_size: maximum number of created slugs to remember
+           (default: SLUGIFY_MEMO_SIZE)
+    :returns: generator yielding slugs
+    """
+    import itertools
+    from collections import deque
+    from garage.utils import parallel_map
+
+    if not chunksize:
+        chunksize = SLUGIFY_CHUNKSIZE
+    memo = {}
+    # strings sent to a worker whose results have not arrived yet
+    in_flight = set()
+    chunks = deque()
+
+    def batches():
+        # yield strings in each chunk that are neither in the memo nor
+        # in flight; slugs found in the memo are kept with the chunk
+        # (the memo may be reset before the chunk's results arrive)
+        source = iter(iterable)
+        while True:
+            chunk = list(itertools.islice(source, chunksize))
+            if not chunk:
+                return
+            known = {}
+            todo = []
+            for s in chunk:
+                if s in known:
+                    continue
+                slug = memo.get(s)
+                known[s] = slug
+                if slug is None and s not in in_flight:
+                    in_flight.add(s)
+                    todo.append(s)
+            chunks.append((chunk, known, todo))
+            yield todo
+
+    results = parallel_map(_slugify_chunk, batches(), workers,
+                           args=(delete_chars, subst_char, transliterate))
+    slugifier = None
+    for slugs in results:
+        chunk, known, todo = chunks.popleft()
+        if len(memo) + len(todo) > memo_size:
+            memo.clear()
+        for s, slug in zip(todo, slugs):
+            known[s] = slug
+            memo[s] = slug
+        in_flight.difference_update(todo)
+        for s in chunk:
+            slug = known[s]
+            if slug is None:
+                # sent with an earlier chunk
+                slug = memo.get(s)
+                if slug is None:
+                    # memo was reset since; slugify it here
+                    if slugifier is None:
+                        slugifier = get_slugifier(delete_chars, subst_char,
+                                                  transliterate)
+                    slug = slugifier(s)
+                known[s] = slug
+            yield slug
 
 
 # function to generate unique slugs for django model entries
@@ -88,6 +296,41 @@ def get_slug_iteration_separator():
 
 slug_pat = r'^(.+){0}(\d+)$'
 
+# cache of compiled slug base regexps (keyed by slug iteration separator)
+# * the regexp for the separator defined in settings is stored under
+#   the key None and is rebuilt when SLUG_ITERATION_SEPARATOR changes.
+_slug_base_regexps = {}
+
+def get_slug_base_regexp(slug_iteration_separator=None):
+    """
+    Return compiled regexp to match slug base and iteration number.
+
+    :param slug_iteration_separator: separator string (default:
+           SLUG_ITERATION_SEPARATOR)
+    :returns: compiled regexp object
+    """
+    key = slug_iteration_separator or None
+    try:
+        return _slug_base_regexps[key]
+    except KeyError:
+        sep = slug_iteration_separator or get_slug_iteration_separator()
+        slug_regex = re.compile(slug_pat.format(re.escape(sep)), re.I)
+        _slug_base_regexps[key] = slug_regex
+        return slug_regex
+
+
+def reset_slug_base_regexp(setting=None, **kwargs):
+    """
+    Discard cached regexp for SLUG_ITERATION_SEPARATOR.
+    * connected to Django's ``setting_changed`` signal.
+    """
+    if setting == 'SLUG_ITERATION_SEPARATOR':
+        _slug_base_regexps.pop(None, None)
+
+setting_changed.connect(reset_slug_base_regexp,
+                        dispatch_uid='garage.slugify.reset_slug_base_regexp')
+
+
 def get_slug_base(slug, slug_iteration_separator=None):
     """
     Return slug minus the slug_iteration_separator + 'n' sufix.
@@ -95,10 +338,7 @@ def get_slug_base(slug, slug_iteration_separator=None):
     * Example: 'article--2' will return 'article' if
       slug_iteration_separator is '--'.
     """
-    if not slug_iteration_separator:
-        slug_iteration_separator = get_slug_iteration_separator()
-    sep = re.escape(slug_iteration_separator)
-    slug_regex = re.compile(slug_pat.format(sep), re.I)
+    slug_regex = get_slug_base_regexp(slug_iteration_separator)
     matched = slug_regex.match(slug)
     if matched:
         return matched.group(1)
@@ -106,6 +346,27 @@ def get_slug_base(slug, slug_iteration_separator=None):
         return slug
 
 
+def get_slug_bases(slugs, slug_iteration_separator=None):
+    """
+    Return list of slug bases for a list of slugs.
+    * batch version of ``get_slug_base``.
+
+    :param slugs: list (or iterable) of slugs
+    :param slug_iteration_separator: separator string (default:
+           SLUG_ITERATION_SEPARATOR)
+    :returns: list of slug bases
+    """
+    match = get_slug_base_regexp(slug_iteration_separator).match
+    bases = []
+    for slug in slugs:
+        matched = match(slug)
+        if matched:
+            bases.append(matched.group(1))
+        else:
+            bases.append(slug)
+    return bases
+
+
 def slug_creation_error(msg=None):
     """
     This function is UNUSED and is here for compatibility purposes.
@@ -195,6 +456,103 @@ def create_unique_slug(obj, slug_field=None, slug_separator=None):
     return slugs[0]
 
 
+# save entries using the database unique index to guarantee unique slugs
+# * ``get_unique_slug`` checks for existing slugs before the entry is
+#   saved, so two concurrent saves can end up with the same slug.
+# * ``save_unique_slug`` skips the pre-check and lets the database
+#   reject duplicates instead: each attempt is performed inside a
+#   savepoint and the slug iteration suffix is advanced whenever an
+#   IntegrityError is raised because the slug exists.
+
+# maximum number of save attempts before giving up
+SLUG_SAVE_MAX_ATTEMPTS = 100
+
+def get_slug_save_max_attempts():
+    from garage import get_setting
+    return get_setting('SLUG_SAVE_MAX_ATTEMPTS', SLUG_SAVE_MAX_ATTEMPTS)
+
+
+def save_unique_slug(instance, slug_field=None, slug_base=None,
+                     prefix=None, suffix=None, slug_separator=None,
+                     max_attempts=None, using=None, **kwargs):
+    """
+    Save model instance with a unique slug.
+    * slug_field must be backed by a unique index (e.g.
+      ``SlugField(unique=True)``) for this function to work.
+    * no queries are performed to test for uniqueness; the entry is
+      saved and, if the database raises an IntegrityError, the slug
+      iteration suffix is advanced and the save is retried.
+    * on IntegrityError, the slug is looked up to make sure the error
+      was caused by a duplicate slug; other errors (e.g. NOT NULL or
+      foreign key constraint failures) are re-raised.
+    * unique slug has the same format as ``get_unique_slug``:
+
+    article -> article
+    article -> article--2
+    article -> article--3
+    etc.
+
+    :param instance: model object instance
+    :param slug_field: unique slug field name (default: 'slug')
+    :param slug_base: slug to use as base for unique slug (default:
+           slug base of the current value of slug_field)
+    :param prefix: prefix to prepend to unique slug
+    :param suffix: suffix to append to unique slug
+    :param slug_separator: string to separate last part of the slug
+           from the base (default: SLUG_ITERATION_SEPARATOR)
+    :param max_attempts: maximum number of save attempts (default:
+           SLUG_SAVE_MAX_ATTEMPTS)
+    :param using: database alias to save to
+    :param kwargs: keyword arguments to pass to ``instance.save``
+    :returns: unique slug
+    """
+    from django.db import IntegrityError, router, transaction
+    if not slug_field:
+        slug_field = 'slug'
+    if not prefix:
+        prefix = ''
+    if not suffix:
+        suffix = ''
+    if not slug_separator:
+        slug_separator = get_slug_iteration_separator()
+    if not max_attempts:
+        max_attempts = get_slug_save_max_attempts()
+    if slug_base is None:
+        try:
+            slug_base = get_slug_base(getattr(instance, slug_field),
+                                      slug_iteration_separator=slug_separator)
+        except (AttributeError, TypeError):
+            slug_base = None
+    if not slug_base:
+        slug_base = 'entry'
+    if using is None:
+        using = router.db_for_write(instance.__class__, instance=instance)
+
+    num = ''
+    next = 1
+    error = None
+    for _ in range(max_attempts):
+        unique_slug = '%s%s%s%s' % (prefix, slug_base, num, suffix)
+        setattr(instance, slug_field, unique_slug)
+        try:
+            with transaction.atomic(using=using):
+                instance.save(using=using, **kwargs)
+            return unique_slug
+        except IntegrityError as e:
+            exc_info = sys.exc_info()
+            queryset = instance.__class__._default_manager.using(using)
+            if instance.pk:
+                queryset = queryset.exclude(pk=instance.pk)
+            if not queryset.filter(**{slug_field: unique_slug}).exists():
+                # not a slug collision
+                six.reraise(*exc_info)
+            error = e
+            next += 1
+            num = '%s%d' % (slug_separator, next)
+    msg = 'Unable to create slug (%(error)s).'
+    raise ValidationError(msg, params={'error': error})
+
+
 
 # unique slug function
 # from: http://djangosnippets.org/snippets/690/
@@ -37,6 +37,7 @@ class BaseTests(SimpleTestCase):
             'garage.test.settings',
             'garage.test.utils',
             'garage.text_utils',
+            'garage.transliterate',
             'garage.urlgen',
             'garage.utils',
         )
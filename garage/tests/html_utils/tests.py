@@ -67,6 +67,10 @@ class HtmlUtilsTests(SimpleTestCase):
         self._msg('expected', expected)
         self.assertEqual(escaped, expected)
 
+        # text without reserved characters is returned unchanged
+        txt = 'he said, q and a: écriture 寫作'
+        self.assertTrue(html_escape(txt) is txt)
+
     def test_html_entities(self):
         """
         Ensure html_entities function is working properly.
@@ -81,6 +85,10 @@ class HtmlUtilsTests(SimpleTestCase):
         self._msg('expected', expected)
         self.assertEqual(escaped, expected)
 
+        # ascii text is returned unchanged
+        txt = 'he said, "q & a" <abc>'
+        self.assertTrue(html_entities(txt) is txt)
+
     def test_escape(self):
         """
         Ensure escape function is working properly.
@@ -151,6 +159,203 @@ class HtmlUtilsTests(SimpleTestCase):
         self._msg('result', result, linebreak=True)
         self.assertEqual(result, ConvertedHtmlText)
 
+    def test_get_converter(self):
+        """
+        get_converter should return a reusable converter per method and
+        thread that produces the same html as markdown and textile.
+        """
+        import re
+        import threading
+        from markdown import markdown
+        from textile import textile
+        from garage.html_utils import (
+            get_converter,
+            NO_CONVERSION,
+            MARKDOWN_CONVERSION,
+            TEXTILE_CONVERSION,
+        )
+        self._msg('test', 'get_converter', first=True)
+
+        self.assertTrue(get_converter(NO_CONVERSION) is None)
+        converter = get_converter(MARKDOWN_CONVERSION)
+        self.assertTrue(converter is get_converter(MARKDOWN_CONVERSION))
+        converters = []
+        thread = threading.Thread(
+            target=lambda: converters.append(
+                get_converter(MARKDOWN_CONVERSION)))
+        thread.start()
+        thread.join()
+        self.assertFalse(converter is converters[0])
+
+        # engine state (e.g. reference links) is reset between uses
+        texts = (
+            ExampleText,
+            'a [link][ref]\n\n[ref]: http://example.com/\n',
+            'a [link][ref]\n',
+        )
+        for txt in texts:
+            result = converter(txt)
+            self._msg('result', result, linebreak=True)
+            self.assertEqual(result, markdown(txt))
+
+        # textile footnote ids are random and unique for each document
+        def normalize_ids(html):
+            return re.sub(r'[0-9a-f]{32}', 'ID', html)
+
+        converter = get_converter(TEXTILE_CONVERSION)
+        texts = (
+            'h2. Fruits\n\n* apples\n* oranges',
+            'A note[1]\n\nfn1. footnote',
+            '"link":ref\n\n[ref]http://example.com/',
+            '"link":ref',
+        )
+        for txt in texts:
+            result = converter(txt)
+            self._msg('result', result, linebreak=True)
+            self.assertEqual(normalize_ids(result), normalize_ids(textile(txt)))
+        self.assertNotEqual(converter(texts[1]), converter(texts[1]))
+
+        # note numbering starts over for each document
+        def normalize_refs(html):
+            return re.sub(r'(id="|href="#)[^"]*', r'\1ID', html)
+
+        texts = (
+            'First[#n1].\n\nnote#n1. First.\n\nnotelist.',
+            'Again[#n2].\n\nnote#n2. Second.\n\nnotelist.',
+            'Again[#n2].\n\nnote#n2. Second.\n\nnotelist.',
+        )
+        for txt in texts:
+            result = converter(txt)
+            self._msg('result', result, linebreak=True)
+            self.assertEqual(normalize_refs(result),
+                             normalize_refs(textile(txt)))
+
+    def test_register_converter(self):
+        """
+        register_converter should replace the converter for a method in
+        all threads.
+        """
+        import threading
+        from garage.html_utils import (
+            get_converter,
+            register_converter,
+            markdown_converter,
+            MARKDOWN_CONVERSION,
+        )
+        self._msg('test', 'register_converter', first=True)
+
+        converters = []
+        def worker(start, done):
+            converters.append(get_converter(MARKDOWN_CONVERSION))
+            start.set()
+            done.wait()
+            converters.append(get_converter(MARKDOWN_CONVERSION))
+        start, done = threading.Event(), threading.Event()
+        thread = threading.Thread(target=worker, args=(start, done))
+        thread.start()
+        start.wait()
+        try:
+            register_converter(MARKDOWN_CONVERSION, lambda: str.upper)
+            done.set()
+            thread.join()
+            self.assertFalse(converters[0] is str.upper)
+            self.assertTrue(converters[1] is str.upper)
+            self.assertTrue(get_converter(MARKDOWN_CONVERSION) is str.upper)
+        finally:
+            register_converter(MARKDOWN_CONVERSION, markdown_converter)
+        self.assertFalse(get_converter(MARKDOWN_CONVERSION) is str.upper)
+
+    def test_txt2html_cache(self):
+        """
+        txt2html should store and retrieve rendered html using the
+        render cache.
+        """
+        from garage.utils import LRUCache
+        from garage.html_utils import (
+            txt2html,
+            get_render_cache,
+            render_cache_key,
+            MARKDOWN_CONVERSION,
+            NO_CONVERSION,
+        )
+        self._msg('test', 'txt2html (cache)', first=True)
+
+        self.assertTrue(get_render_cache(False) is None)
+        self.assertTrue(get_render_cache('local') is get_render_cache('local'))
+
+        cache = LRUCache()
+        result = txt2html(ExampleText, MARKDOWN_CONVERSION, cache=cache)
+        self.assertEqual(result, ConvertedHtmlText)
+        key = render_cache_key(ExampleText, MARKDOWN_CONVERSION)
+        self.assertEqual(cache.get(key), ConvertedHtmlText)
+
+        # cached html is returned without conversion
+        cache.set(key, 'cached')
+        result = txt2html(ExampleText, MARKDOWN_CONVERSION, cache=cache)
+        self.assertEqual(result, 'cached')
+        result = txt2html(ExampleText, MARKDOWN_CONVERSION)
+        self.assertEqual(result, ConvertedHtmlText)
+
+        result = txt2html(ExampleText, NO_CONVERSION, cache=cache)
+        self.assertEqual(result, ExampleText)
+        self.assertEqual(len(cache), 1)
+
+    def test_render_many(self):
+        """
+        render_many should convert texts to html in order and skip
+        items that have not changed.
+        """
+        from garage.utils import LRUCache
+        from garage.html_utils import (
+            render_many,
+            txt2html,
+            render_cache_key,
+            MARKDOWN_CONVERSION,
+            RENDER_UNCHANGED,
+        )
+        self._msg('test', 'render_many', first=True)
+
+        texts = [ExampleText, '*one*', '**two**', '*one*'] * 3
+        expected = [txt2html(txt, MARKDOWN_CONVERSION) for txt in texts]
+        results = list(render_many(iter(texts), MARKDOWN_CONVERSION,
+                                   workers=2, chunksize=5, cache=False))
+        self.assertEqual([html for _, html in results], expected)
+        results = list(render_many(texts, MARKDOWN_CONVERSION, workers=1,
+                                   chunksize=5, cache=False))
+        self.assertEqual([html for _, html in results], expected)
+        self._msg('results', results)
+
+        # unchanged items are skipped
+        hashes = [h for h, _ in results]
+        items = list(zip(texts, hashes))
+        items[1] = ('*changed*', hashes[1])
+        results = list(render_many(items, MARKDOWN_CONVERSION, workers=1,
+                                   cache=False))
+        self.assertEqual([html for _, html in results],
+                         [RENDER_UNCHANGED,
+                          txt2html('*changed*', MARKDOWN_CONVERSION)] +
+                         [RENDER_UNCHANGED] * (len(texts) - 2))
+
+        # None texts are converted to None, not marked as unchanged
+        results = list(render_many([None, ('', None)], MARKDOWN_CONVERSION,
+                                   workers=1, cache=False))
+        self.assertEqual([html for _, html in results], [None, ''])
+        results = list(render_many([(None, results[0][0])],
+                                   MARKDOWN_CONVERSION, workers=1,
+                                   cache=False))
+        self.assertTrue(results[0][1] is RENDER_UNCHANGED)
+
+        # converted html is stored in and retrieved from the render cache
+        cache = LRUCache()
+        results = list(render_many(texts, MARKDOWN_CONVERSION, workers=1,
+                                   cache=cache))
+        self.assertEqual(len(cache), 3)
+        cache.set(render_cache_key('*one*', MARKDOWN_CONVERSION), 'cached')
+        results = list(render_many(texts, MARKDOWN_CONVERSION, workers=1,
+                                   cache=cache))
+        self.assertEqual(results[1][1], 'cached')
+        self.assertEqual(results[0][1], expected[0])
+
     def test_to_html(self):
         """
         Ensure to_html function is working properly.
@@ -260,3 +465,272 @@ class HtmlUtilsTests(SimpleTestCase):
         txt = html_to_text(ConvertedHtmlText)
         self._msg('txt', txt, linebreak=True)
         self.assertEqual(txt, PlainText)
+
+    def test_html_to_text_chunks(self):
+        """
+        html_to_text should accept html as an iterable of chunks and
+        produce the same result as converting the whole document.
+        """
+        from garage.html_utils import html_to_text
+        self._msg('test', 'html_to_text (chunks)', first=True)
+        chunks = [ConvertedHtmlText[i:i+7]
+                  for i in range(0, len(ConvertedHtmlText), 7)]
+        txt = html_to_text(iter(chunks))
+        self._msg('txt', txt, linebreak=True)
+        self.assertEqual(txt, PlainText)
+
+    def test_html_to_text_malformed(self):
+        """
+        html_to_text should treat malformed markup (e.g. an unclosed
+        '<![' marked section) as text instead of raising an error.
+        """
+        from garage.html_utils import html_to_text, iter_html_text
+        self._msg('test', 'html_to_text (malformed)', first=True)
+        data = (
+            ('a <![ b', 'a <![ b'),
+            ('a <![ <b>b</b>', 'a <![ b'),
+            ('<!DOCTYPE [x', '<!DOCTYPE [x'),
+            ('x &a', 'x &a'),
+        )
+        for html, expected in data:
+            txt = html_to_text(html)
+            self._msg('html', html)
+            self._msg('txt', txt)
+            self.assertEqual(txt, expected + '\n')
+        self.assertEqual(''.join(iter_html_text(['a <!', '[ b'])), 'a <![ b')
+
+    def test_html_to_text_references(self):
+        """
+        html_to_text should decode entity and character references and
+        leave bare ampersands (e.g. 'AT&T') as they are.
+        """
+        from garage.html_utils import html_to_text, iter_html_text
+        self._msg('test', 'html_to_text (references)', first=True)
+        data = (
+            ('AT&T rocks', 'AT&T rocks'),
+            ('Q&A session', 'Q&A session'),
+            ('see /search?a=1&b=2&c', 'see /search?a=1&b=2&c'),
+            ('&amp; &amp &eacute; &#233; &#xe9; &#233 &bogus;',
+             '& &amp é é é &#233 &bogus;'),
+        )
+        for html, expected in data:
+            txt = html_to_text(html)
+            self._msg('html', html)
+            self._msg('txt', txt)
+            self.assertEqual(txt, expected + '\n')
+        chunks = ['AT', '&', 'T r', '&am', 'p; x']
+        self.assertEqual(''.join(iter_html_text(chunks)), 'AT&T r& x')
+
+    def test_iter_html_lines(self):
+        """
+        iter_html_lines should yield lines of text with tags removed,
+        entities decoded and blank lines dropped or compressed.
+        """
+        from garage.html_utils import iter_html_lines
+        self._msg('test', 'iter_html_lines', first=True)
+        html = ('<p>Q &amp; A &#233;t&#xe9; &eacute;</p>\n\n\n'
+                '<script>var x = "<b>";</script>\n'
+                '<p>  lorem &unknown; ipsum  </p>\r\n')
+        result = list(iter_html_lines(html))
+        expected = ['Q & A été é', 'lorem &unknown; ipsum']
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+
+        result = list(iter_html_lines([html[:9], html[9:30], html[30:]],
+                                      keep_blank=True))
+        expected = ['Q & A été é', '', 'lorem &unknown; ipsum']
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+
+    def test_html_to_text_formatter(self):
+        """
+        html_to_text with a formatter should convert block elements to
+        separate blocks of plain or markdown-formatted text.
+        """
+        from garage.html_utils import html_to_text
+        self._msg('test', 'html_to_text (formatter)', first=True)
+        html = ('<h2>Fruits &amp; Nuts</h2>'
+                '<p>Some <em>fresh</em> fruit from <a href="/market/">'
+                'the   market</a>.<br>Second line</p>'
+                '<ul><li>apples<ul><li>gala</li></ul></li>'
+                '<li>oranges</li></ul>'
+                '<ol><li>one</li><li>two</li></ol>'
+                '<blockquote><p>quoted <strong>text</strong></p></blockquote>'
+                '<pre>x = 1\n  y = 2</pre>'
+                '<table><tr><td>1</td><td>2</td></tr></table>'
+                '<p><img src="x.png" alt="pic"> end'
+                '<script>var x;</script></p>')
+        result = html_to_text(html, 'plain')
+        expected = ('Fruits & Nuts\n\n'
+                    'Some fresh fruit from the market (/market/).\n'
+                    'Second line\n\n'
+                    '* apples\n\n'
+                    '  * gala\n\n'
+                    '* oranges\n\n'
+                    '1. one\n\n'
+                    '2. two\n\n'
+                    '    quoted text\n\n'
+                    'x = 1\n  y = 2\n\n'
+                    '1 | 2\n\n'
+                    'pic end\n')
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+
+        result = html_to_text([html[:30], html[30:200], html[200:]],
+                              'markdown')
+        expected = ('## Fruits & Nuts\n\n'
+                    'Some *fresh* fruit from [the market](/market/).\n'
+                    'Second line\n\n'
+                    '* apples\n\n'
+                    '  * gala\n\n'
+                    '* oranges\n\n'
+                    '1. one\n\n'
+                    '2. two\n\n'
+                    '> quoted **text**\n\n'
+                    '    x = 1\n      y = 2\n\n'
+                    '1 | 2\n\n'
+                    '![pic](x.png) end\n')
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+
+        # bare ampersands are kept as they are
+        html = '<p>AT&T R&D, Q&amp;A</p><p>/search?a=1&b=2</p>'
+        for formatter in ('plain', 'markdown'):
+            result = html_to_text(html, formatter)
+            self._msg(formatter, result)
+            self.assertEqual(result,
+                             'AT&T R&D, Q&A\n\n/search?a=1&b=2\n')
+
+    def test_html_to_tokens(self):
+        """
+        html_to_tokens should yield lowercase words, without splitting
+        words at chunk boundaries, inline tags or entity references.
+        """
+        from garage.html_utils import html_to_tokens
+        self._msg('test', 'html_to_tokens', first=True)
+        html = ('<h1>Caf&eacute; Menu</h1><p>Fresh <b>bre</b>ad, '
+                'co&#102;fee</p><table><tr><td>tea</td><td>milk</td></tr>'
+                '</table><style>p { color: red; }</style>')
+        expected = ['café', 'menu', 'fresh', 'bread', 'coffee',
+                    'tea', 'milk']
+        result = list(html_to_tokens(html))
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+
+        chunks = [html[i:i+7] for i in range(0, len(html), 7)]
+        result = list(html_to_tokens(chunks))
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+
+    def test_unescape_references(self):
+        """
+        unescape should decode named entities and numeric character
+        references and leave unknown or invalid references as is.
+        """
+        from garage.html_utils import unescape, EntityRefMap
+        self._msg('test', 'unescape (references)', first=True)
+
+        txt = '&#x41;&#65;&#XE9;&#x;&#12ab;&#1114112;&bogus;&AMP;&Eacute;&amp'
+        expected = 'AA&#XE9;&#x;&#12ab;&#1114112;&bogus;&AMP;É&amp'
+        result = unescape(txt)
+        self._msg('text', txt)
+        self._msg('result', result)
+        self._msg('expected', expected)
+        self.assertEqual(result, expected)
+
+        # text without entities is returned unchanged
+        txt = 'no entities here'
+        self.assertTrue(unescape(txt) is txt)
+        txt = b'caf\xc3\xa9'
+        self.assertTrue(unescape(txt) is txt)
+
+        # named entities are decoded while the cache is being reset
+        # (i.e. after ``clear`` and before the named entities are
+        # restored by another thread)
+        refs = EntityRefMap(maxsize=2)
+        for n in range(65, 75):
+            self.assertEqual(refs['&#%d;' % n], chr(n))
+        self.assertTrue(len(refs) <= len(refs.named) + 2)
+        refs.clear()
+        self.assertEqual(refs['&amp;'], '&')
+        self.assertEqual(refs['&eacute;'], 'é')
+
+    def test_sanitize_html(self):
+        """
+        sanitize_html should drop disallowed tags, attributes and urls
+        and close unclosed tags.
+        """
+        from garage.html_utils import sanitize_html
+        self._msg('test', 'sanitize_html', first=True)
+        data = [
+            ('<p class="x" onclick="evil()">Hi <b>there'
+             '<script>alert("<b>")</script></b> &amp; caf&eacute;</p>',
+             '<p class="x">Hi <b>there</b> &amp; café</p>'),
+            ('<a href=" java&#09;script:alert(1)">x</a>'
+             '<a href="/path?a=1&amp;b=2" target=_blank>y</a>'
+             '<img src="data:image/png;base64,xx" alt=\'"q"\'/>',
+             '<a>x</a><a href="/path?a=1&amp;b=2" target="_blank">y</a>'
+             '<img alt="&quot;q&quot;">'),
+            ('<div><ul><li>one<li>two</ul><!-- comment -->'
+             '<font color="red"><em>unclosed<br/>',
+             '<div><ul><li>one</li><li>two</li></ul>'
+             '<em>unclosed<br></em></div>'),
+            ('<iframe src="http://example.com/"><p>x</p></iframe>'
+             '&lt;after&gt;</p></div>',
+             '&lt;after&gt;'),
+            ('<p>R&D dept, AT&T &amp Q&A</p>',
+             '<p>R&amp;D dept, AT&amp;T &amp;amp Q&amp;A</p>'),
+        ]
+        for html, expected in data:
+            result = sanitize_html(html)
+            self._msg('html', html)
+            self._msg('result', result)
+            self.assertEqual(result, expected)
+
+        html = data[0][0]
+        result = sanitize_html([html[:20], html[20:50], html[50:]])
+        self.assertEqual(result, data[0][1])
+
+    def test_sanitize_html_malformed(self):
+        """
+        sanitize_html should escape malformed markup (e.g. an unclosed
+        '<![' marked section) instead of raising an error, and still
+        close open tags.
+        """
+        from garage.html_utils import sanitize_html
+        self._msg('test', 'sanitize_html (malformed)', first=True)
+        data = (
+            ('a <![ b', 'a &lt;![ b'),
+            ('<p>a <![ <script>x</script><b>b', '<p>a &lt;![ <b>b</b></p>'),
+            ('<!DOCTYPE [x', '&lt;!DOCTYPE [x'),
+            ('x &a', 'x &amp;a'),
+        )
+        for html, expected in data:
+            result = sanitize_html(html)
+            self._msg('html', html)
+            self._msg('result', result)
+            self.assertEqual(result, expected)
+
+    def test_sanitizer_policy(self):
+        """
+        SanitizerPolicy should merge global attributes and check url
+        schemes.
+        """
+        from garage.html_utils import SanitizerPolicy, sanitize_html
+        self._msg('test', 'SanitizerPolicy', first=True)
+        policy = SanitizerPolicy(tags=['a', 'p'],
+                                 attributes={'*': ['id'], 'a': ['href']},
+                                 protocols=['https'])
+        self.assertEqual(policy.attributes['p'], frozenset(['id']))
+        self.assertEqual(policy.attributes['a'], frozenset(['id', 'href']))
+        self.assertTrue(policy.allowed_url('https://example.com/'))
+        self.assertTrue(policy.allowed_url('/relative/url:x'))
+        self.assertFalse(policy.allowed_url('HTTP://example.com/'))
+        self.assertFalse(policy.allowed_url('\x01java\nscript:alert(1)'))
+        html = ('<p id="a" class="b"><a href="http://example.com/">x</a> '
+                '<a id="c" href="https://example.com/">y</a><b>z</b></p>')
+        expected = ('<p id="a"><a>x</a> '
+                    '<a id="c" href="https://example.com/">y</a>z</p>')
+        result = sanitize_html(html, policy)
+        self._msg('result', result)
+        self.assertEqual(result, expected)
@@ -151,6 +151,40 @@ class ImageUtilsTests(SimpleTestCase):
         self._msg('file', img_file)
         self._msg('base', img_base)
 
+    def test_get_file_basenames(self):
+        """
+        get_file_basenames should return the same base names as
+        get_file_basename for a list of file names.
+        """
+        from garage.image_utils import (
+            get_file_basename,
+            get_file_basenames,
+        )
+        self._msg('test', 'get_file_basenames', first=True)
+
+        data = [
+            ('a_600X338.png', 'a'),
+            ('a-01x02.JPG', 'a'),
+            ('a-1x2-3x4.jpg', 'a-1x2'),
+            ('a-1x2x3.jpg', 'a-1x2x3'),
+            ('a-600x.jpg', 'a-600x'),
+            ('-600x338.jpg', ''),
+            ('dir/a-1x2.tar.gz', 'a-1x2.tar'),
+            ('a.b.c', 'a.b'),
+            ('README', 'image'),
+            ('foo.', 'image'),
+            ('.jpg', ''),
+            ('path/to/', 'image'),
+            ('line\nbreak-1x2.jpg', 'image'),
+        ]
+        filenames = [f for f, base in data]
+        expected = [base for f, base in data]
+        for f, base in data:
+            self.assertEqual(get_file_basename(f), base)
+            self._msg(repr(f), base)
+        self.assertEqual(get_file_basenames(filenames), expected)
+        self.assertEqual(get_file_basenames(['README'], 'x'), ['x'])
+
     def test_get_img_ext(self):
         """
         get_img_ext should return the appropriate image type extension
@@ -212,3 +246,429 @@ class ImageUtilsTests(SimpleTestCase):
         self._msg('height', height)
         self._msg('ext', fext)
         self.assertTrue(delete_file(thumb))
+
+    def test_generate_thumbs(self):
+        """
+        generate_thumbs should create thumbnails in several sizes,
+        qualities and formats from one image.
+        """
+        from garage.image_utils import (
+            generate_thumbs,
+            get_image_size,
+            get_img_ext,
+        )
+        from garage.utils import delete_file
+        self._msg('test', 'generate_thumbs', first=True)
+
+        tempdir = tempfile.gettempdir()
+        path, fname, w, h, ext = self._get_test_image('rodents')
+        sizes = [(300, 0), (245, 138, 90), (100, 100, 60, 'png')]
+        expected = [
+            (os.path.join(tempdir, 'rodents-300x169.jpg'), 300, 169, 'jpg'),
+            (os.path.join(tempdir, 'rodents-245x138.jpg'), 245, 138, 'jpg'),
+            (os.path.join(tempdir, 'rodents-100x100.png'), 100, 100, 'png'),
+        ]
+        thumbs = generate_thumbs(path, sizes, tempdir)
+        self._msg('thumbs', thumbs)
+        self.assertEqual(thumbs, [e[0] for e in expected])
+        for thumb, width, height, fext in expected:
+            self.assertEqual(get_image_size(thumb), (width, height))
+            self.assertEqual(get_img_ext(thumb), fext)
+            self.assertTrue(delete_file(thumb))
+        self.assertEqual(generate_thumbs(path, [], tempdir), [])
+
+        # alpha channel is kept for formats that support it
+        path = os.path.join(tempdir, 'alpha.png')
+        img = Image.new('RGBA', (200, 100), (255, 0, 0, 0))
+        img.paste((0, 0, 255, 255), (0, 0, 100, 100))
+        img.save(path)
+        sizes = [(50, 50, 75, 'png'), (40, 0, 75, 'webp'), (30, 30, 75, 'jpg')]
+        thumbs = generate_thumbs(path, sizes, tempdir)
+        modes = [Image.open(thumb).mode for thumb in thumbs]
+        self._msg('modes', modes)
+        self.assertEqual(modes, ['RGBA', 'RGBA', 'RGB'])
+        for thumb in thumbs + [path]:
+            self.assertTrue(delete_file(thumb))
+
+    def test_create_thumb_fast(self):
+        """
+        create_thumb in fast mode should decode JPEG images at reduced
+        scale and still create thumbnails of the specified size.
+        """
+        from garage.image_utils import (
+            create_thumb,
+            draft_image,
+            reduce_image,
+            get_image_size,
+        )
+        from garage.utils import delete_file
+        self._msg('test', 'create_thumb (fast)', first=True)
+
+        tempdir = tempfile.gettempdir()
+        path, fname, w, h, ext = self._get_test_image('rodents')
+        img = Image.open(path)
+        draft_image(img, (100, 50))
+        self._msg('draft size', img.size)
+        self.assertEqual(img.size, (150, 85))
+
+        img = Image.new('RGB', (600, 338))
+        self.assertEqual(reduce_image(img, (100, 50)).size, (200, 113))
+        self.assertEqual(reduce_image(img, (245, 138)).size, (600, 338))
+
+        for w, h in ((245, 138), (60, 60)):
+            thumb = create_thumb(path, w, h, 75, tempdir, 'rodents-fast',
+                                 ext, fast=True)
+            self._msg('thumb', thumb)
+            self.assertEqual(get_image_size(thumb), (w, h))
+            self.assertTrue(delete_file(thumb))
+
+    def test_probe_image(self):
+        """
+        probe_image should return format, dimensions, mode and EXIF
+        orientation of an image and cache the result.
+        """
+        from garage.image_utils import (
+            probe_image,
+            probe_images,
+            _probe_cache,
+        )
+        from garage.utils import delete_file
+        self._msg('test', 'probe_image', first=True)
+
+        for label in DEFAULT_TEST_IMAGES:
+            path, fname, w, h, ext = self._get_test_image(label)
+            info = probe_image(path)
+            self._msg(fname, info)
+            self.assertEqual((info.width, info.height, info.ext), (w, h, ext))
+            self.assertTrue(probe_image(path) is info)
+
+        tempdir = tempfile.gettempdir()
+        path = os.path.join(tempdir, 'garage-probe-test.jpg')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (40, 30)).save(path, exif=exif.tobytes())
+        info = probe_image(path)
+        self.assertEqual((info.format, info.mode, info.orientation),
+                         ('JPEG', 'RGB', 6))
+
+        _probe_cache.clear()
+        paths = [path, __file__, self._get_test_image('monkeys1')[0],
+                 os.path.join(tempdir, 'garage-missing.jpg')]
+        probe_image(paths[2])
+        for workers in (1, 2):
+            result = list(probe_images(paths, workers=workers))
+            self._msg('result', result)
+            self.assertEqual([p for p, info in result], paths)
+            self.assertEqual([info and info.width for p, info in result],
+                             [40, None, 600, None])
+        self.assertTrue(delete_file(path))
+
+    def test_generate_thumbs_batch(self):
+        """
+        generate_thumbs_batch should create thumbnails for all images
+        in a directory and skip images with up-to-date thumbnails.
+        """
+        import shutil
+        from garage.image_utils import generate_thumbs_batch
+        self._msg('test', 'generate_thumbs_batch', first=True)
+
+        src = tempfile.mkdtemp()
+        dst = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(src, 'sub'))
+            path = self._get_test_image('rodents')[0]
+            shutil.copy(path, os.path.join(src, 'rodents-600x338.jpg'))
+            path = self._get_test_image('monkeys1')[0]
+            shutil.copy(path, os.path.join(src, 'sub', 'monkeys.png'))
+            with open(os.path.join(src, 'sub', 'broken.jpg'), 'wb') as f:
+                f.write(b'not an image')
+            sizes = [(100, 0), (50, 50)]
+
+            for check in ('mtime', 'hash'):
+                report = generate_thumbs_batch(src, sizes, dst, check=check,
+                                               workers=2)
+                self._msg('report', report)
+                self.assertEqual(report.failed, 1)
+                self.assertEqual(report.failures[0][0],
+                                 os.path.join(src, 'sub', 'broken.jpg'))
+                self.assertEqual(report.created + report.skipped, 2)
+                self.assertTrue(report.bytes_saved > 0)
+
+                report = generate_thumbs_batch(src, sizes, dst, check=check,
+                                               workers=1)
+                self._msg('report', report)
+                self.assertEqual((report.created, report.skipped), (0, 2))
+
+            for thumb in ('rodents-100x56.jpg', 'rodents-50x50.jpg',
+                          'sub/monkeys-100x56.png', 'sub/monkeys-50x50.png'):
+                self.assertTrue(os.path.isfile(os.path.join(dst, thumb)))
+
+            # paths from an iterable are written to dest_dir
+            paths = [os.path.join(src, 'sub', 'monkeys.png')]
+            report = generate_thumbs_batch(paths, sizes, dst, workers=1)
+            self.assertEqual(report.created, 1)
+            self.assertTrue(os.path.isfile(
+                os.path.join(dst, 'monkeys-50x50.png')))
+
+            # thumbnails of rotated images are named by oriented size
+            path = os.path.join(src, 'rot6.jpg')
+            exif = Image.Exif()
+            exif[0x0112] = 6
+            Image.new('RGB', (150, 50)).save(path, exif=exif.tobytes())
+            for created, skipped in ((1, 0), (0, 1)):
+                report = generate_thumbs_batch([path], [(50, 0)], dst,
+                                               workers=1)
+                self._msg('report', report)
+                self.assertEqual((report.created, report.skipped),
+                                 (created, skipped))
+            self.assertTrue(os.path.isfile(
+                os.path.join(dst, 'rot6-50x150.jpg')))
+        finally:
+            shutil.rmtree(src)
+            shutil.rmtree(dst)
+
+    def test_thumbnail_cache(self):
+        """
+        ThumbnailCache should key thumbnails by image content and
+        settings, generate missing thumbnails and wait for thumbnails
+        being generated by another request.
+        """
+        import shutil
+        import threading
+        from garage.image_utils import ThumbnailCache, get_image_size
+        from garage.utils import make_dir
+        self._msg('test', 'ThumbnailCache', first=True)
+
+        src = tempfile.mkdtemp()
+        cache_dir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(src, 'a'))
+            os.mkdir(os.path.join(src, 'b'))
+            path1 = os.path.join(src, 'a', 'image.jpg')
+            path2 = os.path.join(src, 'b', 'image.jpg')
+            shutil.copy(self._get_test_image('rodents')[0], path1)
+            shutil.copy(self._get_test_image('monkeys1')[0], path2)
+            thumbs = ThumbnailCache(cache_dir)
+
+            thumb1 = thumbs.get(path1, 100, 50)
+            self._msg('thumb', thumb1)
+            self.assertTrue(thumb1.startswith(cache_dir))
+            self.assertTrue(thumb1.endswith('-100x50.jpg'))
+            self.assertEqual(get_image_size(thumb1), (100, 50))
+            mtime = os.path.getmtime(thumb1)
+            self.assertEqual(thumbs.get(path1, 100, 50), thumb1)
+            self.assertEqual(os.path.getmtime(thumb1), mtime)
+
+            # same file name, different content
+            thumb2 = thumbs.get(path2, 100, 50)
+            self.assertNotEqual(thumb2, thumb1)
+            self.assertTrue(thumb2.endswith('-100x50.png'))
+            # different settings
+            self.assertNotEqual(thumbs.get(path1, 100, 50, quality=60),
+                                thumb1)
+
+            # wait for thumbnail generated by another request
+            thumb = thumbs.get_path(path1, 80, 0)
+            lock = '%s.lock' % thumb
+            make_dir(os.path.dirname(thumb))
+            self.assertTrue(thumbs.acquire_lock(lock))
+            self.assertFalse(thumbs.acquire_lock(lock))
+
+            def generate():
+                thumbs.generate(path1, thumb, 80, 0, 75, False)
+                thumbs.release_lock(lock)
+
+            timer = threading.Timer(0.2, generate)
+            timer.start()
+            self.assertEqual(thumbs.get(path1, 80, 0), thumb)
+            timer.join()
+            self.assertEqual(get_image_size(thumb), (80, 45))
+
+            # stale lock
+            thumb = thumbs.get_path(path1, 40, 40)
+            make_dir(os.path.dirname(thumb))
+            self.assertTrue(thumbs.acquire_lock('%s.lock' % thumb))
+            os.utime('%s.lock' % thumb, (0, 0))
+            self.assertEqual(thumbs.get(path1, 40, 40), thumb)
+            self.assertFalse(os.path.exists('%s.lock' % thumb))
+        finally:
+            shutil.rmtree(src)
+            shutil.rmtree(cache_dir)
+
+    def test_create_thumb_io(self):
+        """
+        create_thumb_io should create thumbnails in memory from paths,
+        file objects or bytes.
+        """
+        import io
+        from garage.image_utils import create_thumb_io
+        self._msg('test', 'create_thumb_io', first=True)
+
+        path = self._get_test_image('rodents')[0]
+        with open(path, 'rb') as f:
+            data = f.read()
+        for image_file in (path, io.BytesIO(data), data):
+            output, w, h, ext = create_thumb_io(image_file, 100, 0)
+            self.assertEqual((w, h, ext), (100, 56, 'jpg'))
+            img = Image.open(output)
+            self.assertEqual((img.format, img.size), ('JPEG', (100, 56)))
+
+        output, w, h, ext = create_thumb_io(data, 50, 50, ext='png')
+        img = Image.open(output)
+        self.assertEqual((img.format, img.size), ('PNG', (50, 50)))
+
+    def test_create_thumb_storage(self):
+        """
+        create_thumb_storage should save thumbnail with a storage
+        backend.
+        """
+        import io
+        import shutil
+        from django.core.files.storage import FileSystemStorage
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from garage.image_utils import create_thumb_storage
+        self._msg('test', 'create_thumb_storage', first=True)
+
+        location = tempfile.mkdtemp()
+        try:
+            storage = FileSystemStorage(location=location)
+            path = self._get_test_image('rodents')[0]
+            with open(path, 'rb') as f:
+                upload = SimpleUploadedFile('upload-600x338.jpg', f.read())
+            name = create_thumb_storage(upload, 100, 50, 'thumbs',
+                                        storage=storage)
+            self._msg('name', name)
+            self.assertEqual(name, 'thumbs/upload-100x50.jpg')
+            with storage.open(name) as f:
+                img = Image.open(io.BytesIO(f.read()))
+            self.assertEqual(img.size, (100, 50))
+        finally:
+            shutil.rmtree(location)
+
+    def test_resize_image_orientation(self):
+        """
+        resize_image should rotate images according to their EXIF
+        orientation and crop at an anchor.
+        """
+        import io
+        from PIL import ImageChops, ImageStat
+        from garage.image_utils import (
+            resize_image,
+            create_thumb_io,
+            get_entropy_anchor,
+        )
+        self._msg('test', 'resize_image (orientation)', first=True)
+
+        path = self._get_test_image('rodents')[0]
+        img = Image.open(path)
+        expected = resize_image(img.transpose(Image.ROTATE_270), (100, 150),
+                                True)
+        output = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        img.save(output, format='JPEG', quality=95, exif=exif.tobytes())
+        output.seek(0)
+        rotated = Image.open(output)
+        result = resize_image(rotated, (100, 150), True)
+        self.assertEqual(result.size, (100, 150))
+        diff = ImageStat.Stat(ImageChops.difference(result, expected)).mean
+        self._msg('diff', diff)
+        self.assertTrue(max(diff) < 5)
+        result = resize_image(rotated, (100, 150), True, orient=False)
+        diff = ImageStat.Stat(ImageChops.difference(result, expected)).mean
+        self.assertTrue(max(diff) > 5)
+
+        # thumbnail size is calculated from the oriented size
+        thumb, w, h, ext = create_thumb_io(output.getvalue(), 100, 0)
+        self.assertEqual((w, h), (100, 178))
+        self.assertEqual(Image.open(thumb).size, (100, 178))
+
+        # left half is flat, right half has detail
+        img = Image.new('L', (400, 200), 128)
+        noise = Image.effect_noise((200, 200), 64)
+        img.paste(noise, (200, 0))
+        ax, ay = get_entropy_anchor(img, (100, 100))
+        self._msg('anchor', (ax, ay))
+        self.assertTrue(ax > 0.9)
+        self.assertEqual(ay, 0.5)
+        result = resize_image(img, (100, 100), True, anchor='entropy')
+        expected = resize_image(img, (100, 100), True, anchor=(1.0, 0.5))
+        self.assertEqual(result.tobytes(), expected.tobytes())
+
+        # explicit anchors are positions in the displayed image
+        # * the displayed image is blue on the left and red on the right
+        data = (
+            (3, (200, 100), (0, 0, 100, 100)),
+            (6, (100, 200), (0, 0, 100, 100)),
+        )
+        for orientation, size, red_box in data:
+            img = Image.new('RGB', size, (0, 0, 255))
+            img.paste((255, 0, 0), red_box)
+            output = io.BytesIO()
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            img.save(output, format='JPEG', quality=95, exif=exif.tobytes())
+            output.seek(0)
+            oriented = Image.open(output)
+            for anchor, color in (((0.0, 0.5), 'blue'), ((1.0, 0.5), 'red')):
+                result = resize_image(oriented, (50, 100), True, anchor=anchor)
+                r, g, b = ImageStat.Stat(result).mean
+                self._msg('orientation %d' % orientation, (anchor, r, b))
+                self.assertEqual(color, 'red' if r > b else 'blue')
+
+    def test_encode_image(self):
+        """
+        encode_image should encode images in the requested output
+        format and select the smallest encoding in 'auto' mode.
+        """
+        import io
+        from garage.image_utils import (
+            encode_image,
+            create_thumb,
+            get_image_size,
+        )
+        from garage.utils import delete_file
+        self._msg('test', 'encode_image', first=True)
+
+        path = self._get_test_image('monkeys1')[0]
+        img = Image.open(path).convert('RGB').resize((150, 85))
+        data = [
+            ('jpg', 'jpg', 'JPEG', 'RGB'),
+            ('webp', 'webp', 'WEBP', 'RGB'),
+            ('png', 'png', 'PNG', 'RGB'),
+            ('png8', 'png', 'PNG', 'P'),
+        ]
+        sizes = {}
+        for fmt, ext, pil_format, mode in data:
+            encoded = encode_image(img, fmt, 75)
+            self._msg(fmt, encoded.size)
+            self.assertEqual((encoded.format, encoded.ext), (fmt, ext))
+            self.assertEqual(encoded.size, len(encoded.data))
+            result = Image.open(io.BytesIO(encoded.data))
+            self.assertEqual((result.format, result.mode, result.size),
+                             (pil_format, mode, (150, 85)))
+            sizes[fmt] = encoded.size
+
+        encoded = encode_image(img, 'jpg', 75, {'progressive': False})
+        self.assertFalse('progressive' in Image.open(
+            io.BytesIO(encoded.data)).info)
+
+        encoded = encode_image(img, 'auto', 75,
+                               auto_formats=('jpg', 'png', 'png8'))
+        self._msg('auto', encoded.sizes)
+        self.assertEqual(encoded.sizes, {'jpg': sizes['jpg'],
+                                         'png': sizes['png'],
+                                         'png8': sizes['png8']})
+        self.assertEqual(encoded.size, min(encoded.sizes.values()))
+
+        # images with alpha are not encoded as jpg
+        encoded = encode_image(img.convert('RGBA'), 'auto', 75,
+                               auto_formats=('jpg', 'png8'))
+        self.assertEqual(list(encoded.sizes), ['png8'])
+        self.assertEqual(Image.open(io.BytesIO(encoded.data)).mode, 'P')
+
+        tempdir = tempfile.gettempdir()
+        thumb = create_thumb(path, 100, 50, 75, tempdir, 'monkeys', 'webp')
+        self.assertEqual(thumb, os.path.join(tempdir, 'monkeys-100x50.webp'))
+        self.assertEqual(get_image_size(thumb), (100, 50))
+        self.assertTrue(delete_file(thumb))
@@ -250,3 +250,254 @@ class SlugifyTests(SimpleTestCase):
         expected = '{0}{1}{2}'.format(slug_base, separator, ncopy)
         self.assertEqual(result, expected)
         self._msg('slug', result)
+
+    def test_save_unique_slug(self):
+        """
+        save_unique_slug will save a model instance and advance the
+        slug suffix whenever the database raises an IntegrityError.
+        """
+        self._msg('test', 'save_unique_slug', first=True)
+        from django.core.exceptions import ValidationError
+        from django.db import IntegrityError
+        from garage.slugify import save_unique_slug, SLUG_ITERATION_SEPARATOR
+        separator = SLUG_ITERATION_SEPARATOR
+
+        obj = Mock()
+        obj.slug = 'example'
+        result = save_unique_slug(obj, using='default')
+        expected = 'example'
+        self.assertEqual(result, expected)
+        self.assertEqual(obj.slug, expected)
+        self.assertEqual(obj.save.call_count, 1)
+        self._msg('slug', result)
+
+        # existing slugs: example, example--2
+        existing = set(['example', 'example{0}2'.format(separator)])
+
+        def side_effect(**kwargs):
+            if obj.slug in existing:
+                raise IntegrityError('duplicate slug')
+
+        def get_model(existing):
+            # model whose queryset finds the slugs in existing
+            def filter_side_effect(**kwargs):
+                result = Mock()
+                result.exists.return_value = kwargs['slug'] in existing
+                return result
+            queryset = Mock()
+            queryset.exclude.return_value = queryset
+            queryset.filter.side_effect = filter_side_effect
+            model = Mock()
+            model._default_manager.using.return_value = queryset
+            return model
+
+        obj = Mock()
+        obj.__class__ = get_model(existing)
+        obj.slug = 'example{0}1'.format(separator)
+        obj.save.side_effect = side_effect
+        result = save_unique_slug(obj, using='default')
+        expected = 'example{0}3'.format(separator)
+        self.assertEqual(result, expected)
+        self.assertEqual(obj.slug, expected)
+        self.assertEqual(obj.save.call_count, 3)
+        self._msg('slug', result)
+
+        # give up after max_attempts
+        obj = Mock()
+        obj.__class__ = get_model(set(['example{0}{1}'.format(separator, n)
+                                       for n in range(2, 6)] + ['example']))
+        obj.slug = 'example'
+        obj.save.side_effect = IntegrityError('duplicate slug')
+        with self.assertRaises(ValidationError) as cm:
+            save_unique_slug(obj, max_attempts=5, using='default')
+        self.assertEqual(obj.save.call_count, 5)
+        self.assertEqual(cm.exception.params['error'],
+                         obj.save.side_effect)
+        self._msg('error', cm.exception.messages)
+
+        # other integrity errors (slug does not exist) are re-raised
+        obj = Mock()
+        obj.__class__ = get_model(set())
+        obj.slug = 'example'
+        obj.save.side_effect = IntegrityError('NOT NULL constraint failed')
+        with self.assertRaises(IntegrityError) as cm:
+            save_unique_slug(obj, using='default')
+        self.assertTrue(cm.exception is obj.save.side_effect)
+        self.assertEqual(obj.save.call_count, 1)
+
+    def test_slugifier(self):
+        """
+        Slugifier should produce the same slugs as the original
+        sequential ``slugify`` implementation.
+        """
+        from garage.slugify import Slugifier, get_slugifier, slugify
+        self._msg('test', 'Slugifier', first=True)
+
+        corpus = (
+            ("\r\nJohn's 99.5% of  A/B_C testing...\n",
+             'johns-99-5-percent-of-a-b-c-testing',
+             'johns_99_5_percent_of__a_b_c_testing___'),
+            ('Q&amp;A &lt;b&gt;bold&lt;/b&gt; &amp;amp; tom &eacute;t&#233;',
+             'q-and-a-bold-and-tom-été',
+             'q_and_a;_bold__and__tom_été'),
+            ('<p>Hello <em>World</em></p> --- end -- ',
+             'hello-world-end',
+             'hello_world_____end____'),
+            ('a...b....c',
+             'a-b-c',
+             'a___b____c'),
+            ('Rock & Roll / Jazz_Fusion',
+             'rock-and-roll-jazz-fusion',
+             'rock__and__roll___jazz_fusion'),
+            ('  __--..  ',
+             '',
+             '__________'),
+        )
+        slugifier = Slugifier()
+        custom_slugifier = Slugifier(delete_chars='-. ', subst_char='_')
+        for txt, expected, custom_expected in corpus:
+            result = slugifier(txt)
+            self._msg('text', txt)
+            self._msg('result', result)
+            self._msg('expected', expected)
+            self.assertEqual(result, expected)
+            result = custom_slugifier(txt)
+            self._msg('result', result)
+            self._msg('expected', custom_expected)
+            self.assertEqual(result, custom_expected)
+
+        # compiled slugifiers are cached per configuration
+        self.assertTrue(get_slugifier() is get_slugifier())
+        self.assertFalse(get_slugifier() is get_slugifier('-. ', '_'))
+
+        # delete_chars can be any iterable of characters
+        self.assertTrue(get_slugifier(['-', '.', ' '], '_') is
+                        get_slugifier('-. ', '_'))
+        self.assertEqual(slugify('a b', delete_chars=['a']), 'b')
+        self.assertEqual(slugify('a.b', delete_chars=set(['.', 'ab'])),
+                         'a-b')
+
+        # the cache does not grow with new transliterate functions
+        from garage.slugify import _slugifiers, SLUGIFIER_CACHE_SIZE
+        for i in range(SLUGIFIER_CACHE_SIZE * 2):
+            self.assertEqual(slugify('Ab', transliterate=lambda s: s), 'ab')
+            self.assertTrue(len(_slugifiers) <= SLUGIFIER_CACHE_SIZE)
+
+    def test_slugify_many(self):
+        """
+        slugify_many should return the same slugs as slugify, in the
+        same order as the input.
+        """
+        from garage.slugify import slugify, slugify_many
+        self._msg('test', 'slugify_many', first=True)
+
+        titles = [
+            'The Renaissance of Giselle “G” Töngi',
+            'Apoyan resolución a favor de niños migrantes en LA',
+            '“foo! écriture 寫作 #bar???”',
+            'Rock & Roll / Jazz_Fusion',
+        ] * 5
+        expected = [slugify(t) for t in titles]
+        result = list(slugify_many(iter(titles), workers=2, chunksize=3))
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+
+        result = list(slugify_many(titles, workers=1, chunksize=3))
+        self.assertEqual(result, expected)
+
+        result = list(slugify_many(titles, workers=1, delete_chars='-. ',
+                                   subst_char='_'))
+        expected = [slugify(t, delete_chars='-. ', subst_char='_')
+                    for t in titles]
+        self.assertEqual(result, expected)
+
+        # repeated strings are only slugified once, even if chunks are
+        # read ahead (as parallel_map does when workers > 1)
+        sent = []
+
+        def read_ahead_map(func, iterable, workers=None, args=()):
+            batches = list(iterable)
+            for batch in batches:
+                sent.extend(batch)
+            return [func(batch, *args) for batch in batches]
+
+        with patch('garage.utils.parallel_map', read_ahead_map):
+            result = list(slugify_many(['Same Title'] * 20, workers=2,
+                                       chunksize=2))
+        self.assertEqual(result, ['same-title'] * 20)
+        self.assertEqual(sent, ['Same Title'])
+
+        # strings in flight when the memo is reset are still returned
+        with patch('garage.utils.parallel_map', read_ahead_map):
+            result = list(slugify_many(titles, workers=2, chunksize=3,
+                                       memo_size=2))
+        self.assertEqual(result, [slugify(t) for t in titles])
+
+        # results are the same when the memo discards slugs
+        for workers in (1, 2):
+            result = list(slugify_many(titles, workers=workers, chunksize=3,
+                                       memo_size=2))
+            self.assertEqual(result, [slugify(t) for t in titles])
+
+        self.assertEqual(list(slugify_many([], workers=2)), [])
+
+    def test_get_slug_bases(self):
+        """
+        get_slug_bases should return the slug base for each slug in a
+        list.
+        """
+        self._msg('test', 'get_slug_bases', first=True)
+        from garage.slugify import get_slug_bases
+        slugs = ['example', 'example--2', 'example-2015--12', 'example-3']
+        expected = ['example', 'example', 'example-2015', 'example-3']
+        result = get_slug_bases(slugs, slug_iteration_separator='--')
+        self.assertEqual(result, expected)
+        self._msg('slugs', slugs)
+        self._msg('result', result)
+
+        expected = ['example', 'example-', 'example-2015-', 'example']
+        result = get_slug_bases(slugs, slug_iteration_separator='-')
+        self.assertEqual(result, expected)
+        self._msg('result', result)
+
+    def test_get_slug_base_regexp(self):
+        """
+        get_slug_base_regexp should be cached and rebuilt when the
+        SLUG_ITERATION_SEPARATOR setting changes.
+        """
+        self._msg('test', 'get_slug_base_regexp', first=True)
+        from garage.slugify import get_slug_base, get_slug_base_regexp
+        regexp = get_slug_base_regexp()
+        self.assertTrue(regexp is get_slug_base_regexp())
+        self.assertEqual(get_slug_base('example--2'), 'example')
+        with override_settings(SLUG_ITERATION_SEPARATOR='~'):
+            self.assertFalse(regexp is get_slug_base_regexp())
+            self.assertEqual(get_slug_base('example--2'), 'example--2')
+            self.assertEqual(get_slug_base('example~2'), 'example')
+        self.assertEqual(get_slug_base('example--2'), 'example')
+        self.assertEqual(get_slug_base('example~2'), 'example~2')
+
+    def test_slugify_transliterate(self):
+        """
+        slugify should use the transliterate function (if supplied) to
+        convert text to ascii.
+        """
+        from garage.slugify import slugify
+        from garage.transliterate import transliterate
+        self._msg('test', 'slugify transliterate', first=True)
+
+        examples = (
+            ('Пример статьи', 'primer-stati'),
+            ('Ελληνικά κείμενα', 'ellinika-keimena'),
+            ('The Renaissance of Giselle “G” Töngi',
+             'the-renaissance-of-giselle-g-tongi'),
+            ('John’s Straße', 'johns-strasse'),
+        )
+        for txt, expected in examples:
+            result = slugify(txt, transliterate=transliterate)
+            self._msg('text', txt)
+            self._msg('result', result)
+            self._msg('expected', expected)
+            self.assertEqual(result, expected)
+
+        self.assertEqual(slugify('Пример статьи'), '')
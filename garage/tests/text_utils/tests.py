@@ -203,6 +203,31 @@ class TextUtilsTests(SimpleTestCase):
         self._msg('txt', txt)
         self._msg('result', result)
 
+    def test_char_stats(self):
+        """
+        char_stats should count digits, letters, alphanumerics, white
+        space and non-ascii characters.
+        """
+        self._msg('test', 'char_stats', first=True)
+        from garage.text_utils import char_stats, char_stats_many
+        data = [
+            ('', (0, 0, 0, 0, 0)),
+            ('foo bar 42!', (2, 6, 8, 2, 0)),
+            ('Caf\xe9 \u0663\u00a0\u5beb-1', (2, 5, 7, 2, 4)),
+            (b'a1 \xe9', (1, 2, 3, 1, 1)),
+        ]
+        for txt, expected in data:
+            result = char_stats(txt)
+            self._msg('txt', repr(txt))
+            self._msg('result', repr(result))
+            self.assertEqual((result.digits, result.letters, result.alphanum,
+                              result.whitespace, result.non_ascii),
+                             expected)
+
+        results = char_stats_many([txt for txt, _ in data])
+        self.assertEqual([r.alphanum for r in results],
+                         [expected[2] for _, expected in data])
+
     def test_tidy_txt(self):
         """
         tidy_txt should compress runs of blank lines to 2 ('\n\n') (so
@@ -217,6 +242,24 @@ class TextUtilsTests(SimpleTestCase):
         self._msg('raw text', repr(txt), linebreak=True)
         self._msg('result', repr(result), linebreak=True)
 
+    def test_iter_tidy_txt(self):
+        """
+        iter_tidy_txt should yield stripped lines with runs of blank
+        lines compressed to one for text blocks and iterables of lines.
+        """
+        self._msg('test', 'iter_tidy_txt', first=True)
+        import io
+        from garage.text_utils import iter_tidy_txt
+        result = list(iter_tidy_txt(DUMMY_TEXT))
+        expected = FORMATTED.split('\n')
+        self.assertEqual(result, expected)
+
+        stream = io.StringIO('  foo \r\n\n \n\t\nbar\n baz\n\n')
+        result = list(iter_tidy_txt(stream))
+        expected = ['foo', '', 'bar', 'baz', '']
+        self._msg('result', repr(result))
+        self.assertEqual(result, expected)
+
     def test_to_camel_case(self):
         """
         to_camel_case should convert a string to CamelCase.
@@ -287,6 +330,49 @@ class TextUtilsTests(SimpleTestCase):
         self._msg('expected', expected)
         self._msg('result', result)
 
+    def test_substitute_nested(self):
+        """
+        substitute should expand variables in substituted values and
+        raise SubstitutionError for cyclic references.
+        """
+        self._msg('test', 'substitute (nested)', first=True)
+        from garage.text_utils import (
+            substitute,
+            get_template,
+            SubstitutionError,
+        )
+        txt = '${GREETING}, ${NAME}!'
+        context = {
+            'GREETING': '${HELLO}',
+            'HELLO': 'Hello',
+            'NAME': '${FIRST} ${LAST}',
+            'FIRST': 'Jane',
+            'LAST': 'Doe',
+        }
+        result = substitute(txt, context)
+        expected = 'Hello, Jane Doe!'
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+
+        template = get_template(txt)
+        self.assertEqual(template.parts, ['', 'GREETING', ', ', 'NAME', '!'])
+        self.assertTrue(get_template(txt) is template)
+
+        # values are expanded more than once if they are used again
+        context = {'A': '${B}${B}', 'B': 'x'}
+        result = substitute('${A}-${A}', context)
+        self.assertEqual(result, 'xx-xx')
+
+        for context in ({'A': '${A}'}, {'A': '-${B}', 'B': '${A}'}):
+            self._msg('context', repr(context))
+            with self.assertRaises(SubstitutionError):
+                substitute('${A}', context)
+
+        # None values (e.g. from dict.get) are substituted with ''
+        self.assertEqual(substitute('x ${a} y', lambda k: None), 'x  y')
+        context = {'A': '${B}!'}
+        self.assertEqual(substitute('${A}${C}', context.get), '!')
+
     def test_subs(self):
         """
         subs should perform simple substitution using Python's named
@@ -377,3 +463,40 @@ class TextUtilsTests(SimpleTestCase):
         self._msg('txt', txt)
         self._msg('expected', expected)
         self._msg('result', result)
+
+    def test_truncate_text(self):
+        """
+        truncate_text should truncate text to 'maxlen' characters
+        (including ellipsis) in chars, words or html mode.
+        """
+        self._msg('test', 'truncate_text', first=True)
+        from garage.text_utils import truncate_text, truncate_many
+        html = '<p>foo <b>bar &amp; baz</b> qux</p><p>norf</p>'
+        data = [
+            ('foo bar baz qux norf', 12, 'chars', 'foo bar b...'),
+            ('foo bar baz qux norf', 20, 'chars', 'foo bar baz qux norf'),
+            ('foo', 2, 'chars', '...'),
+            ('foo bar baz qux norf', 12, 'words', 'foo bar...'),
+            ('foo bar baz qux norf', 14, 'words', 'foo bar baz...'),
+            ('foobarbazquxnorf', 10, 'words', 'foobarb...'),
+            (html, 12, 'html', '<p>foo <b>bar &amp;...</b></p>'),
+            (html, 16, 'html', '<p>foo <b>bar &amp; baz</b>...</p>'),
+            (html, 18, 'html', '<p>foo <b>bar &amp; baz</b> q...</p>'),
+            (html, 21, 'html', html),
+            ('<p>foo<br/><!-- <b> -->bar baz</p>', 7, 'html',
+             '<p>foo<br/><!-- <b> -->b...</p>'),
+        ]
+        for txt, maxlen, mode, expected in data:
+            result = truncate_text(txt, maxlen, mode)
+            self._msg('txt', txt)
+            self._msg('result', result)
+            self.assertEqual(result, expected)
+
+        result = truncate_text('foo bar baz', 8, ellipsis='…')
+        self.assertEqual(result, 'foo bar…')
+
+        texts = ['foo bar baz', 'foo', 'foo bar']
+        result = truncate_many(texts, 7, 'words')
+        self.assertEqual(result, ['foo...', 'foo', 'foo bar'])
+        with self.assertRaises(ValueError):
+            truncate_many(texts, 7, 'lines')
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+tests.transliterate.tests
+
+Tests for garage.transliterate
+
+* created: 2026-10-19
+* updated: 2026-10-19
+"""
+
+from __future__ import (absolute_import, unicode_literals)
+
+from garage.test import SimpleTestCase
+
+
+class TransliterateTests(SimpleTestCase):
+
+    def test_transliterate(self):
+        """
+        transliterate should convert Latin, Greek and Cyrillic text to
+        ascii.
+        """
+        from garage.transliterate import transliterate
+        self._msg('test', 'transliterate', first=True)
+
+        examples = (
+            ('écriture', 'ecriture'),
+            ('Straße Øresund Łódź', 'Strasse Oresund Lodz'),
+            ('Пример статьи', 'Primer stati'),
+            ('Щука і їжак', 'Shchuka i yizhak'),
+            ('Ελληνικά κείμενα', 'Ellinika keimena'),
+            ('John’s “quote” — end…', 'John\'s "quote" - end...'),
+            ('ascii only', 'ascii only'),
+            ('寫作', ''),
+        )
+        for txt, expected in examples:
+            result = transliterate(txt)
+            self._msg('text', txt)
+            self._msg('result', result)
+            self._msg('expected', expected)
+            self.assertEqual(result, expected)
+
+        result = transliterate('Пример Straße', tables=('latin',))
+        self.assertEqual(result, ' Strasse')
+
+    def test_get_transliterator(self):
+        """
+        get_transliterator should return cached Transliterator
+        instances that memoize converted characters.
+        """
+        from garage.transliterate import (
+            get_transliterator,
+            Transliterator,
+            DEFAULT_TRANSLIT_TABLES,
+        )
+        self._msg('test', 'get_transliterator', first=True)
+
+        transliterator = get_transliterator()
+        self.assertTrue(isinstance(transliterator, Transliterator))
+        self.assertTrue(transliterator is
+                        get_transliterator(list(DEFAULT_TRANSLIT_TABLES)))
+        self.assertFalse(transliterator is get_transliterator(('greek',)))
+
+        self.assertEqual(transliterator('Жé'), 'Zhe')
+        self.assertEqual(transliterator.map[ord('Ж')], 'Zh')
+        self.assertEqual(transliterator.map[ord('é')], 'e')
+
+        # custom tables
+        transliterator = Transliterator(('cyrillic', {ord('ж'): 'j'}))
+        self.assertEqual(transliterator('жук'), 'juk')
@@ -478,6 +478,45 @@ class UtilsTests(SimpleTestCase):
         self._msg('y', obj.y)
         self._msg('z', obj.z)
 
+    def test_lru_cache(self):
+        """
+        LRUCache should store values and discard the least recently
+        used entries when full.
+        """
+        from garage.utils import LRUCache
+        self._msg('test', 'LRUCache', first=True)
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('b', 'default'), 'default')
+        cache.delete('a')
+        self.assertFalse('a' in cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_parallel_map(self):
+        """
+        parallel_map should apply function to each item and return
+        results in order.
+        """
+        from garage.utils import parallel_map
+        self._msg('test', 'parallel_map', first=True)
+        items = range(20)
+        expected = [pow(n, 2) for n in items]
+        result = list(parallel_map(pow, iter(items), workers=2, args=(2,)))
+        self._msg('result', result)
+        self.assertEqual(result, expected)
+        result = list(parallel_map(pow, items, workers=1, args=(2,)))
+        self.assertEqual(result, expected)
+        self.assertEqual(list(parallel_map(pow, [], workers=2, args=(2,))),
+                         [])
+
     def test_get_file_ext(self):
         """
         Ensure get_file_ext function is working properly.
@@ -14,7 +14,10 @@ import six
 import re
 import string
 
-from garage.utils import default_encoding
+from garage.utils import (
+    default_encoding,
+    DataObject,
+)
 
 
 def uprint(data, encoding=default_encoding):
@@ -57,6 +60,10 @@ def check_eos(s, cr=CR):
 
 # string test functions
 
+DIGIT_CHARS = frozenset(string.digits)
+ALPHA_CHARS = frozenset(string.ascii_letters)
+ALPHANUM_CHARS = DIGIT_CHARS | ALPHA_CHARS
+
 def has_digits(s):
     """
     Test if string has digits.
@@ -64,7 +71,7 @@ def has_digits(s):
     :param s: string
     :returns: number of digits in string
     """
-    return len(set(s) & set(string.digits))
+    return len(DIGIT_CHARS.intersection(s))
 
 def has_alpha(s):
     """
@@ -73,7 +80,7 @@ def has_alpha(s):
     :param s: string
     :returns: number of letters in string
     """
-    return len(set(s) & set(string.letters))
+    return len(ALPHA_CHARS.intersection(s))
 
 def has_alphanum(s):
     """
@@ -82,8 +89,123 @@ def has_alphanum(s):
     :param s: string
     :returns: number of letters and digits in string
     """
-    alphanum = set(string.letters + string.digits)
-    return len(set(s) & alphanum)
+    return len(ALPHANUM_CHARS.intersection(s))
+
+
+# character class statistics
+# * characters are translated to one-letter class codes (lowercase for
+#   ascii, uppercase for non-ascii characters) which are then counted,
+#   so a string is classified in a single ``translate`` pass.
+
+CHAR_CLASS_DIGIT = 'd'
+CHAR_CLASS_LETTER = 'l'
+CHAR_CLASS_SPACE = 's'
+CHAR_CLASS_OTHER = 'o'
+
+class CharClassMap(dict):
+    """
+    Translate table (for ``unicode.translate``) to map characters to
+    character class codes.
+    * classes for non-ascii characters are looked up the first time a
+      character is encountered and cached.
+    """
+
+    def __init__(self):
+        super(CharClassMap, self).__init__()
+        for n in range(128):
+            self[n] = self.classify(six.unichr(n))
+
+    @staticmethod
+    def classify(c):
+        if c.isdigit():
+            code = CHAR_CLASS_DIGIT
+        elif c.isalpha():
+            code = CHAR_CLASS_LETTER
+        elif c.isspace():
+            code = CHAR_CLASS_SPACE
+        else:
+            code = CHAR_CLASS_OTHER
+        if ord(c) > 127:
+            code = code.upper()
+        return code
+
+    def __missing__(self, codepoint):
+        code = self[codepoint] = self.classify(six.unichr(codepoint))
+        return code
+
+CHAR_CLASS_MAP = CharClassMap()
+
+def char_stats(s):
+    """
+    Count digits, letters, alphanumerics, white space and non-ascii
+    characters in string in a single pass.
+    * unicode digits and letters are counted (unlike ``has_digits``
+      and friends, which only count distinct ascii characters).
+    * byte strings are decoded as latin-1.
+
+    :param s: string
+    :returns: DataObject with ``digits``, ``letters``, ``alphanum``,
+              ``whitespace`` and ``non_ascii`` counts
+    """
+    if not isinstance(s, six.text_type):
+        s = s.decode('latin-1')
+    codes = s.translate(CHAR_CLASS_MAP)
+    ascii_digits = codes.count(CHAR_CLASS_DIGIT)
+    ascii_letters = codes.count(CHAR_CLASS_LETTER)
+    ascii_spaces = codes.count(CHAR_CLASS_SPACE)
+    non_ascii = len(codes) - (ascii_digits + ascii_letters + ascii_spaces +
+                              codes.count(CHAR_CLASS_OTHER))
+    if non_ascii:
+        digits = ascii_digits + codes.count(CHAR_CLASS_DIGIT.upper())
+        letters = ascii_letters + codes.count(CHAR_CLASS_LETTER.upper())
+        spaces = ascii_spaces + codes.count(CHAR_CLASS_SPACE.upper())
+    else:
+        digits, letters, spaces = ascii_digits, ascii_letters, ascii_spaces
+    return DataObject(
+        digits=digits,
+        letters=letters,
+        alphanum=digits + letters,
+        whitespace=spaces,
+        non_ascii=non_ascii)
+
+def char_stats_many(strings):
+    """
+    Return character class statistics for a list of strings.
+
+    :param strings: iterable of strings
+    :returns: list of ``char_stats`` results
+    """
+    return [char_stats(s) for s in strings]
+
+
+def iter_tidy_txt(lines):
+    """
+    Tidy up lines of text by compressing multiple blank lines.
+    * lines are stripped of beginning and ending white space (including
+      line endings).
+    * multiple blank lines are reduced to one.
+    * lines can be any iterable of strings (e.g. a file object or a
+      generator) so large files can be processed without loading them
+      into memory; if lines is a string, it is split on newlines.
+
+    with open_file(path) as f:
+        for line in iter_tidy_txt(f):
+            ...
+
+    :param lines: iterable of lines of text or text block
+    :returns: generator yielding tidied up lines
+    """
+    if isinstance(lines, six.string_types):
+        lines = lines.split('\n')
+    blank = False
+    for line in lines:
+        line = line.strip()
+        if line:
+            blank = False
+            yield line
+        elif not blank:
+            blank = True
+            yield ''
 
 
 def tidy_txt(txt):
@@ -91,24 +213,13 @@ def tidy_txt(txt):
     Utility function to tidy up text block by compressing multiple
     blank lines.
     * multiple (>2) blank lines are reduced to 2.
+    * see ``iter_tidy_txt`` to process files or iterables of lines.
 
     :param txt: text block
     :returns: tidied up text block with multiple blank lines removed.
     """
     if isinstance(txt, six.text_type):
-        lines = unicode(txt).split('\n')
-        s = []
-        run = 0
-        for line in lines:
-            txt = line.strip()
-            if len(txt) == 0:
-                if run < 1:
-                    s.append('')
-                run += 1
-            else:
-                run = 0
-                s.append(txt)
-        txt = '\n'.join(s)
+        txt = '\n'.join(iter_tidy_txt(txt))
     return txt
 
 
@@ -143,11 +254,134 @@ def to_camel_case(name):
 IdPattern = r'\$\{([a-z_][a-z0-9_]*)\}'
 IdRegexp = re.compile(IdPattern, re.I)
 
+# maximum depth of nested variable expansion
+SUBSTITUTE_MAX_DEPTH = 20
+
+# maximum number of compiled templates to cache
+SUBSTITUTE_CACHE_SIZE = 1000
+
+
+class SubstitutionError(ValueError):
+    """Raised if variables in a template cannot be expanded."""
+    pass
+
+
+class SubstitutionTemplate(object):
+    """
+    Template compiled for variable substitution.
+    * the text is parsed once into a list of literal text and variable
+      names; rendering joins the literal text with the variable values.
+    * variable values are expanded in turn if they contain variables
+      (up to ``SUBSTITUTE_MAX_DEPTH`` levels).
+
+    :param txt: template text
+    :param regexp: compiled regexp to match variables (group 1 is
+           the variable name)
+    """
+
+    def __init__(self, txt, regexp):
+        self.regexp = regexp
+        # literal text at even indices, variable names at odd indices
+        self.parts = parts = []
+        pos = 0
+        for m in regexp.finditer(txt):
+            parts.append(txt[pos:m.start()])
+            parts.append(m.group(1))
+            pos = m.end()
+        parts.append(txt[pos:])
+
+    def render(self, getval, names=(), depth=0, values=None):
+        """
+        Render template.
+
+        :param getval: function to retrieve value for a variable name
+        :param names: variables being expanded (to detect cycles)
+        :param depth: current expansion depth
+        :param values: dict of expanded values (shared with nested
+               templates so each variable is only expanded once)
+        :returns: text with variables substituted
+        :raises: SubstitutionError if values reference each other in a
+                 cycle or are nested too deeply
+        """
+        parts = self.parts
+        if len(parts) == 1:
+            return parts[0]
+        if depth > SUBSTITUTE_MAX_DEPTH:
+            raise SubstitutionError(
+                'Variable expansion exceeds maximum depth (%d)'
+                % SUBSTITUTE_MAX_DEPTH)
+        if values is None:
+            values = {}
+        parts = list(parts)
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            try:
+                parts[i] = values[name]
+                continue
+            except KeyError:
+                pass
+            value = getval(name)
+            if value is None:
+                # e.g. dict.get for unknown keys (same as re.sub)
+                value = ''
+            elif not isinstance(value, six.string_types):
+                value = six.text_type(value)
+            if self.regexp.search(value):
+                if name in names:
+                    raise SubstitutionError(
+                        'Cyclic reference to variable: %s' % name)
+                template = get_template(value, self.regexp)
+                value = template.render(getval, names + (name,), depth + 1,
+                                        values)
+            parts[i] = values[name] = value
+        return ''.join(parts)
+
+
+def get_substitute_regexp(pattern=None):
+    """
+    Return compiled regexp for variable pattern.
+
+    :param pattern: regexp pattern or compiled regexp object (default
+           is ``IdRegexp``)
+    :returns: compiled regexp
+    """
+    if pattern is None:
+        return IdRegexp
+    if isinstance(pattern, six.string_types):
+        return re.compile(pattern, re.I)
+    return pattern
+
+
+# cache of compiled templates (keyed by text and regexp)
+_templates = {}
+
+def get_template(txt, pattern=None):
+    """
+    Return compiled ``SubstitutionTemplate`` for text.
+    * compiled templates are cached.
+
+    :param txt: template text
+    :param pattern: regexp pattern or compiled regexp object
+    :returns: SubstitutionTemplate instance
+    """
+    regexp = get_substitute_regexp(pattern)
+    key = (txt, regexp)
+    try:
+        return _templates[key]
+    except KeyError:
+        if len(_templates) >= SUBSTITUTE_CACHE_SIZE:
+            _templates.clear()
+        template = _templates[key] = SubstitutionTemplate(txt, regexp)
+        return template
+
+
 def substitute(txt, context, pattern=None):
     """
     Perform variable substitution on a chunk of text.
     * returns None if input text is None.
     * default var pattern is ${var}
+    * variables in substituted values are expanded in turn; raises
+      ``SubstitutionError`` if values reference each other in a cycle.
 
     Parameters:
     * txt is text or template to perform substitution on
@@ -156,26 +390,13 @@ def substitute(txt, context, pattern=None):
     """
     if txt is None:
         return None
-    if pattern is None:
-        regexp = IdRegexp
-    elif isinstance(pattern, six.string_types):
-        regexp = re.compile(pattern, re.I)
-    else:
-        regexp = pattern
     if hasattr(context, '__call__'):
         getval = context
     else:
         if context is None:
             context = {}
         getval = lambda kw: context.get(kw, '')
-    done = False
-    while not done:
-        matches = regexp.findall(txt)
-        if len(matches) > 0:
-            txt = regexp.sub(lambda m: getval(m.group(1)), txt)
-        else:
-            done = True
-    return txt
+    return get_template(txt, pattern).render(getval)
 
 
 # simple string substitution function
@@ -224,19 +445,134 @@ def safe_str(obj):
         return unicode(obj).encode('unicode_escape')
 
 
-# utility function to truncate text
+# utility functions to truncate text
+
+TRUNCATE_ELLIPSIS = '...'
+
+TRUNCATE_MODES = ('chars', 'words', 'html')
+
+# html tokens: comments, tags, entity/character references and text
+HtmlTokenRegexp = re.compile(
+    r'(<!--.*?-->)|(<[^>]*>)|(&#?\w+;)|([^<&]+|[<&])', re.S)
+HtmlTagRegexp = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)[^>]*?(/?)>')
+
+def _truncate_words(txt, length):
+    """
+    Truncate text to at most length characters at a word boundary.
+    * falls back on truncating at length characters if the first word
+      is longer than length.
+    """
+    if length <= 0:
+        return ''
+    if txt[length:length + 1].isspace():
+        return txt[:length].rstrip()
+    head = txt[:length]
+    for i in range(len(head) - 1, 0, -1):
+        if head[i].isspace():
+            return head[:i].rstrip()
+    return head
+
+
+def _truncate_html(txt, maxlen, ellipsis):
+    """
+    Truncate html to at most maxlen text characters (tags are not
+    counted and entities count as one character) and close tags left
+    open.
+    """
+    from garage.html_utils import VOID_TAGS
+    length = maxlen - len(ellipsis)
+    count = 0
+    end = None
+    open_tags = []
+    end_tags = None
+    for m in HtmlTokenRegexp.finditer(txt):
+        comment, tag, entity, text = m.groups()
+        if text is not None or entity is not None:
+            n = len(text) if text is not None else 1
+            if end is None and count + n > length:
+                # truncation point
+                if text is not None:
+                    end = m.start() + max(length - count, 0)
+                else:
+                    end = m.start()
+                end_tags = list(open_tags)
+            count += n
+            if count > maxlen:
+                break
+        elif tag is not None and end is None:
+            t = HtmlTagRegexp.match(tag)
+            if t is None:
+                continue
+            closing, name, self_closing = t.groups()
+            name = name.lower()
+            if self_closing or name in VOID_TAGS:
+                continue
+            if closing:
+                if name in open_tags:
+                    # close tag and any tags left open inside it
+                    i = len(open_tags) - 1 - open_tags[::-1].index(name)
+                    del open_tags[i:]
+            else:
+                open_tags.append(name)
+    if count <= maxlen:
+        return txt
+    closing = ''.join('</%s>' % name for name in reversed(end_tags))
+    return '%s%s%s' % (txt[:end], ellipsis, closing)
+
+
+def truncate_text(txt, maxlen, mode='chars', ellipsis=TRUNCATE_ELLIPSIS):
+    """
+    Truncate text to at most ``maxlen`` characters, including ellipsis.
+    * modes:
+      'chars' - truncate at maxlen characters
+      'words' - truncate at the last word boundary before maxlen
+      'html' - count only text characters (tags are not counted and
+        entities count as one character), never cut inside tags or
+        entities and close tags left open by truncation
+    * text that fits is returned unchanged.
+
+    :param txt: text to truncate
+    :param maxlen: maximum length (including ellipsis)
+    :param mode: 'chars', 'words' or 'html'
+    :param ellipsis: text to append to truncated text
+    :returns: text (truncated if necessary)
+    """
+    if len(txt) <= maxlen:
+        return txt
+    if mode == 'html':
+        return _truncate_html(txt, maxlen, ellipsis)
+    length = maxlen - len(ellipsis)
+    if mode == 'words':
+        return '%s%s' % (_truncate_words(txt, length), ellipsis)
+    if mode != 'chars':
+        raise ValueError('Invalid truncate mode: %s' % mode)
+    return '%s%s' % (txt[:max(length, 0)], ellipsis)
+
+
+def truncate_many(texts, maxlen, mode='chars', ellipsis=TRUNCATE_ELLIPSIS):
+    """
+    Truncate list of texts (e.g. excerpts for a listing page).
+
+    :param texts: iterable of texts
+    :param maxlen: maximum length (including ellipsis)
+    :param mode: 'chars', 'words' or 'html' (see ``truncate_text``)
+    :param ellipsis: text to append to truncated texts
+    :returns: list of texts (truncated if necessary)
+    """
+    if mode not in TRUNCATE_MODES:
+        raise ValueError('Invalid truncate mode: %s' % mode)
+    return [truncate_text(txt, maxlen, mode, ellipsis) for txt in texts]
+
 
 def truncate_chars(data, maxlen):
     """
     Truncate string to at most ``maxlen``, including elipsis.
-    * uses django.utils.text Truncator class.
+    * see ``truncate_text`` for word and html-aware truncation.
 
     :param data: string to truncate
     :param maxlen: length to truncate to
     :returns: string (truncated if necessary)
     """
-    from django.utils.text import Truncator
-    if isinstance(data, six.text_type) and len(data) > maxlen:
-        truncator = Truncator(data)
-        data = truncator.chars(maxlen)
+    if isinstance(data, six.text_type):
+        data = truncate_text(data, maxlen)
     return data
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+garage.transliterate
+
+Functions to transliterate unicode text to ascii.
+* ``garage.slugify.strip_accents`` drops every character that does not
+  decompose to ascii, so titles in non-Latin scripts end up as empty
+  slugs. The transliteration tables below map characters in these
+  scripts to reasonable ascii equivalents.
+
+How to use:
+
+    from garage.slugify import slugify
+    from garage.transliterate import transliterate
+
+    slug = slugify('Пример статьи', transliterate=transliterate)
+    # slug is 'primer-stati'
+
+    # use only specific tables
+    from garage.transliterate import get_transliterator
+    slug = slugify(title, transliterate=get_transliterator(('latin',)))
+
+* created: 2026-10-19
+* updated: 2026-10-19
+"""
+
+from __future__ import (absolute_import, unicode_literals)
+
+import six
+from unicodedata import normalize
+
+
+# transliteration tables
+# * tables map unicode code points to ascii strings.
+# * characters not found in the tables are decomposed (NFKD) and looked
+#   up again; anything that is still not ascii is dropped.
+
+def make_table(mapping, capitalize=True):
+    """
+    Create transliteration table (code point -> ascii) from mapping.
+
+    :param mapping: dict of lowercase characters and transliterations
+    :param capitalize: add uppercase characters to the table
+    :returns: transliteration table
+    """
+    table = {}
+    for c, t in mapping.items():
+        table[ord(c)] = t
+        if capitalize:
+            upper = c.upper()
+            if upper != c and len(upper) == 1:
+                table.setdefault(ord(upper), t.capitalize())
+    return table
+
+
+# characters that do not decompose to ascii
+LATIN_TABLE = make_table({
+    'ß': 'ss',
+    'æ': 'ae',
+    'œ': 'oe',
+    'ø': 'o',
+    'đ': 'd',
+    'ð': 'd',
+    'þ': 'th',
+    'ł': 'l',
+    'ħ': 'h',
+    'ı': 'i',
+    'ŋ': 'ng',
+    'ŧ': 't',
+    'ſ': 's',
+    'ĸ': 'q',
+})
+
+GREEK_TABLE = make_table({
+    'α': 'a',
+    'β': 'v',
+    'γ': 'g',
+    'δ': 'd',
+    'ε': 'e',
+    'ζ': 'z',
+    'η': 'i',
+    'θ': 'th',
+    'ι': 'i',
+    'κ': 'k',
+    'λ': 'l',
+    'μ': 'm',
+    'ν': 'n',
+    'ξ': 'x',
+    'ο': 'o',
+    'π': 'p',
+    'ρ': 'r',
+    'σ': 's',
+    'ς': 's',
+    'τ': 't',
+    'υ': 'y',
+    'φ': 'f',
+    'χ': 'ch',
+    'ψ': 'ps',
+    'ω': 'o',
+})
+
+# Russian, Ukrainian, Belarusian, Serbian and Macedonian
+CYRILLIC_TABLE = make_table({
+    'а': 'a',
+    'б': 'b',
+    'в': 'v',
+    'г': 'g',
+    'д': 'd',
+    'е': 'e',
+    'ё': 'yo',
+    'ж': 'zh',
+    'з': 'z',
+    'и': 'i',
+    'й': 'y',
+    'к': 'k',
+    'л': 'l',
+    'м': 'm',
+    'н': 'n',
+    'о': 'o',
+    'п': 'p',
+    'р': 'r',
+    'с': 's',
+    'т': 't',
+    'у': 'u',
+    'ф': 'f',
+    'х': 'kh',
+    'ц': 'ts',
+    'ч': 'ch',
+    'ш': 'sh',
+    'щ': 'shch',
+    'ъ': '',
+    'ы': 'y',
+    'ь': '',
+    'э': 'e',
+    'ю': 'yu',
+    'я': 'ya',
+    'є': 'ye',
+    'і': 'i',
+    'ї': 'yi',
+    'ґ': 'g',
+    'ў': 'u',
+    'ђ': 'dj',
+    'ј': 'j',
+    'љ': 'lj',
+    'њ': 'nj',
+    'ћ': 'c',
+    'џ': 'dz',
+    'ѓ': 'gj',
+    'ќ': 'kj',
+    'ѕ': 'dz',
+})
+
+PUNCTUATION_TABLE = make_table({
+    '‘': "'",
+    '’': "'",
+    '‚': "'",
+    '“': '"',
+    '”': '"',
+    '„': '"',
+    '«': '"',
+    '»': '"',
+    '–': '-',
+    '—': '-',
+    '…': '...',
+    '\xa0': ' ',
+}, capitalize=False)
+
+TRANSLIT_TABLES = {
+    'latin': LATIN_TABLE,
+    'greek': GREEK_TABLE,
+    'cyrillic': CYRILLIC_TABLE,
+    'punctuation': PUNCTUATION_TABLE,
+}
+
+DEFAULT_TRANSLIT_TABLES = ('latin', 'greek', 'cyrillic', 'punctuation')
+
+
+class TranslitMap(dict):
+    """
+    Translate table (for ``unicode.translate``) that transliterates
+    and memoizes each character the first time it is looked up.
+
+    :param table: transliteration table (code point -> ascii)
+    """
+
+    def __init__(self, table):
+        super(TranslitMap, self).__init__()
+        self.table = table
+
+    def __missing__(self, codepoint):
+        try:
+            result = self.table[codepoint]
+        except KeyError:
+            chars = []
+            for c in normalize('NFKD', six.unichr(codepoint)):
+                chars.append(self.table.get(ord(c), c))
+            result = ''.join(chars).encode('ascii', 'ignore').decode('ascii')
+        self[codepoint] = result
+        return result
+
+
+class Transliterator(object):
+    """
+    Transliterate unicode text to ascii.
+    * use ``get_transliterator`` to retrieve cached instances.
+
+    :param tables: list of table names (see TRANSLIT_TABLES) or
+           transliteration tables (dicts) to use; tables later in the
+           list take precedence.
+    """
+
+    def __init__(self, tables=DEFAULT_TRANSLIT_TABLES):
+        table = {}
+        for t in tables:
+            if isinstance(t, six.string_types):
+                t = TRANSLIT_TABLES[t]
+            table.update(t)
+        self.map = TranslitMap(table)
+
+    def __call__(self, s):
+        s = six.text_type(s)
+        try:
+            s.encode('ascii')
+        except UnicodeEncodeError:
+            return s.translate(self.map)
+        return s
+
+
+# cache of transliterators (keyed by table names)
+_transliterators = {}
+
+def get_transliterator(tables=DEFAULT_TRANSLIT_TABLES):
+    """
+    Return ``Transliterator`` for list of table names.
+    * instances are created on first use and cached.
+
+    :param tables: list of table names (see TRANSLIT_TABLES)
+    :returns: Transliterator instance
+    """
+    key = tuple(tables)
+    try:
+        return _transliterators[key]
+    except KeyError:
+        transliterator = _transliterators[key] = Transliterator(key)
+        return transliterator
+
+
+def transliterate(s, tables=DEFAULT_TRANSLIT_TABLES):
+    """
+    Transliterate (unicode) string to ascii.
+    * can be used in place of ``strip_accents`` when creating slugs
+      (see ``garage.slugify.slugify``).
+
+    :param s: text to transliterate
+    :param tables: list of table names (see TRANSLIT_TABLES)
+    :returns: ascii version of text
+    """
+    return get_transliterator(tables)(s)
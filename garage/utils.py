@@ -375,6 +375,111 @@ def enum(*sequential, **named):
     return type(str('Enum'), (), enums)
 
 
+# in-process cache
+
+DEFAULT_LRU_CACHE_SIZE = 1000
+
+class LRUCache(object):
+    """
+    Simple thread-safe in-process cache that discards the least
+    recently used entries when it is full.
+    * get/set/delete have the same signatures as Django's cache
+      backends (timeout is ignored), so either can be used where a
+      cache object is expected.
+
+    cache = LRUCache(maxsize=100)
+    cache.set('key', data)
+    data = cache.get('key')
+
+    """
+
+    def __init__(self, maxsize=DEFAULT_LRU_CACHE_SIZE):
+        import threading
+        from collections import OrderedDict
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = value
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+
+# batch processing
+
+def parallel_map(func, iterable, workers=None, args=(), max_pending=None,
+                 maxtasksperchild=None):
+    """
+    Apply function to each item using a pool of worker processes.
+    * results are yielded in the same order as the items.
+    * items are read from iterable only as results are consumed (at
+      most max_pending items are queued), so large inputs are never
+      loaded into memory all at once.
+    * func must be picklable (i.e. a module-level function).
+    * if workers is 1, func is called in the current process.
+
+    :param func: function to call as ``func(item, *args)``
+    :param iterable: items to process
+    :param workers: number of worker processes (default: number of CPUs)
+    :param args: additional arguments to pass to func
+    :param max_pending: maximum number of queued items (default: 2 *
+           workers)
+    :param maxtasksperchild: number of items a worker process handles
+           before it is replaced (to release memory; default: no limit)
+    :returns: generator yielding results
+    """
+    import multiprocessing
+    from collections import deque
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    args = tuple(args)
+    if workers <= 1:
+        for item in iterable:
+            yield func(item, *args)
+        return
+    if not max_pending:
+        max_pending = workers * 2
+    pool = multiprocessing.Pool(workers, maxtasksperchild=maxtasksperchild)
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(pool.apply_async(func, (item,) + args))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 # get file extension
 
 def get_file_ext(filename):